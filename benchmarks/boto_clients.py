@@ -0,0 +1,82 @@
+"""per-call `aws()` overhead with a new boto client and jmespath compile per
+call (the old behaviour) vs. the shared clients and compiled queries, and
+pages fetched by a lookup that matches on the first page.
+
+AWS is replaced with the botocore Stubber, so no credentials are needed:
+
+    $ python benchmarks/boto_clients.py
+"""
+from __future__ import print_function
+import argparse
+import os
+
+import jmespath
+from botocore.stub import Stubber
+
+from utils import latency
+from gimel import aws_api
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+ALIAS = {'AliasArn': 'arn:aws:lambda:us-east-1:123456789012:function:gimel-track:live',
+         'FunctionVersion': '1', 'Name': 'live'}
+PAGES = 10
+
+
+def _get_alias(stubbed_client):
+    stubber = Stubber(stubbed_client)
+    stubber.add_response('get_alias', ALIAS)
+    stubber.activate()
+    return stubbed_client
+
+
+def _uncached(iterations):
+    """ aws() as it was: a new session, client and compiled query per call """
+    def call(i):
+        service_client = _get_alias(aws_api.boto3.session.Session().client('lambda'))
+        result = service_client.get_alias(FunctionName='gimel-track', Name='live')
+        jmespath.compile('AliasArn').search(result)
+    return latency(call, iterations)
+
+
+def _cached(iterations):
+    stubber = Stubber(aws_api.client('lambda'))
+    for _ in range(iterations):
+        stubber.add_response('get_alias', ALIAS)
+    with stubber:
+        return latency(lambda i: aws_api.aws('lambda', 'get_alias', FunctionName='gimel-track',
+                                             Name='live', query='AliasArn'), iterations)
+
+
+def _resource_pages(lookup):
+    """ number of get_resources pages a lookup of the first resource fetches """
+    stubber = Stubber(aws_api.client('apigateway'))
+    for page in range(PAGES):
+        response = {'items': [{'id': 'r{}'.format(page), 'path': '/p{}'.format(page)}]}
+        if page < PAGES - 1:
+            response['position'] = str(page + 1)
+        stubber.add_response('get_resources', response)
+    with stubber:
+        lookup('apigateway', 'get_resources', restApiId='api', query='items[?path==`/p0`].id | [0]')
+        return PAGES - len(stubber._queue)
+
+
+def run(iterations):
+    return {'uncached': _uncached(iterations),
+            'cached': _cached(iterations),
+            'pages': {'full_result': _resource_pages(aws_api.aws),
+                      'streamed': _resource_pages(aws_api.first)}}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+    results = run(args.iterations)
+    for name in ('uncached', 'cached'):
+        print('{0:>10}: mean {mean_ms:.3f}ms p50 {p50_ms:.3f}ms '
+              'p99 {p99_ms:.3f}ms'.format(name, **results[name]))
+    print('get_resources pages fetched: {full_result} full result, '
+          '{streamed} streamed'.format(**results['pages']))
@@ -0,0 +1,51 @@
+"""per-call `track` latency with a new redis client per call (the old
+`_redis()` behaviour) vs. the shared connection pool.
+
+usage (against a local redis-server):
+
+    $ redis-server --port 6399 --save ''
+    $ python benchmarks/connection.py --port 6399
+"""
+from __future__ import print_function
+import argparse
+
+from utils import redis, gimel, config, latency, use_redis
+
+
+def _new_client_per_call(*args):
+    redis_config = dict(config['redis'])
+    redis_config['charset'] = 'utf-8'
+    redis_config['decode_responses'] = True
+    return redis.Redis(**redis_config)
+
+
+def _track(i):
+    gimel.track({'namespace': 'gimel-bench', 'experiment': 'connection',
+                 'variant': 'v{}'.format(i % 2), 'event': 'participate',
+                 'uuid': 'uuid-{}'.format(i)}, None)
+
+
+def run(iterations):
+    pooled_redis = gimel._redis
+    try:
+        gimel._redis = _new_client_per_call
+        before = latency(_track, iterations)
+    finally:
+        gimel._redis = pooled_redis
+    after = latency(_track, iterations)
+    # only remove our own keys, this might run against a real redis
+    r = gimel._redis()
+    r.delete(*r.keys('gimel-bench:*'))
+    return {'new_client_per_call': before, 'pooled': after}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--iterations', type=int, default=2000)
+    args = parser.parse_args()
+    use_redis(args.host, args.port)
+    for name, result in sorted(run(args.iterations).items()):
+        print('{0:>20}: mean {mean_ms:.3f}ms p50 {p50_ms:.3f}ms '
+              'p99 {p99_ms:.3f}ms'.format(name, **result))
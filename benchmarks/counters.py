@@ -0,0 +1,77 @@
+"""memory and accuracy of HyperLogLog, hybrid (see `exact_threshold` in
+config.json) and exact counters on synthetic uuid streams.
+
+usage (against a local redis-server, version 4 or above):
+
+    $ redis-server --port 6399 --save ''
+    $ python benchmarks/counters.py --port 6399
+"""
+from __future__ import print_function
+from collections import OrderedDict
+import argparse
+import random
+import uuid
+
+from utils import gimel, config, use_redis
+
+MODES = OrderedDict([('hll', 0), ('hybrid', 1000), ('exact', 10 ** 9)])
+
+
+def _stream(cardinality, duplicates=0.2, seed=0):
+    """ yields `cardinality` unique uuids, with about `duplicates` of them
+        sent more than once
+    """
+    rng = random.Random(seed)
+    seen = []
+    for _ in range(cardinality):
+        seen.append(str(uuid.UUID(int=rng.getrandbits(128))))
+        yield seen[-1]
+        if rng.random() < duplicates:
+            yield rng.choice(seen)
+
+
+def _measure(mode, cardinality):
+    r = gimel._redis('gimel-bench', 'counters')
+    r.delete(*(r.keys('gimel-bench:*') or ['gimel-bench:none']))
+    config['exact_threshold'] = MODES[mode]
+    batch = []
+    for uuid_ in _stream(cardinality):
+        batch.append({'namespace': 'gimel-bench', 'experiment': 'counters',
+                      'variant': 'a', 'event': 'participate', 'uuid': uuid_})
+        if len(batch) == 1000:
+            gimel.track_batch({'events': batch}, None)
+            batch = []
+    gimel.track_batch({'events': batch}, None)
+    key = gimel._counter_key('gimel-bench', 'counters', 'participate', 'a')
+    count = gimel._results_dict('gimel-bench', 'counters')[key]
+    return {'count': count,
+            'error_pct': abs(count - cardinality) * 100.0 / cardinality,
+            'type': r.type(key),
+            'bytes': r.execute_command('MEMORY', 'USAGE', key)}
+
+
+def run(quick=False):
+    exact_threshold = config.pop('exact_threshold', 0)
+    results = OrderedDict()
+    try:
+        for cardinality in (10, 100, 1000, 10000) + (() if quick else (100000,)):
+            results[cardinality] = OrderedDict(
+                (mode, _measure(mode, cardinality)) for mode in MODES)
+    finally:
+        config['exact_threshold'] = exact_threshold
+        r = gimel._redis('gimel-bench', 'counters')
+        r.delete(*(r.keys('gimel-bench:*') or ['gimel-bench:none']))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--quick', action='store_true')
+    args = parser.parse_args()
+    use_redis(args.host, args.port)
+    for cardinality, modes in run(args.quick).items():
+        for mode, result in modes.items():
+            print('{0:>7} {1:>7}: {bytes:>9} bytes {error_pct:6.2f}% error ({type})'.format(
+                cardinality, mode, **result))
@@ -0,0 +1,406 @@
+"""benchmarks of the gimel hot paths against a throwaway local redis-server.
+
+usage:
+
+    $ python benchmarks/run.py --output before.json
+    $ python benchmarks/run.py --quick --only track,results
+
+results are written as JSON, so runs on different commits can be compared.
+"""
+from __future__ import print_function
+from collections import OrderedDict
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+
+from utils import ROOT, gimel, config, redis_server, flush, latency, events
+from gimel import backfill, backup, hll, metrics, optional, stats
+import boto_clients
+import connection
+import counters
+import sentinel
+import shards
+
+
+def _populate(experiment, keys, uuids_per_key):
+    """ creates an experiment with `keys` counter keys (two variants) """
+    goals = ['participate'] + ['goal-{}'.format(i) for i in range(keys // 2 - 1)]
+    batch = []
+    for event in events(experiment, keys * uuids_per_key, goals=goals):
+        batch.append(event)
+        if len(batch) == 10000:
+            gimel.track_batch({'events': batch}, None)
+            batch = []
+    gimel.track_batch({'events': batch}, None)
+
+
+def _events_per_sec(batches, handler):
+    start = time.time()
+    count = 0
+    for batch in batches:
+        handler(batch)
+        count += len(batch)
+    return {'events': count, 'events_per_sec': count / (time.time() - start)}
+
+
+def bench_track(quick):
+    count = 2000 if quick else 20000
+    tracked = list(events('track', count, goals=('participate', 'signup', 'buy')))
+    results = OrderedDict()
+    flush()
+    results['single'] = _events_per_sec(
+        [[event] for event in tracked],
+        lambda batch: gimel.track(batch[0], None))
+    for size in (10, 100, 1000):
+        flush()
+        results['batch_{}'.format(size)] = _events_per_sec(
+            [tracked[i:i + size] for i in range(0, count, size)],
+            lambda batch: gimel.track_batch({'events': batch}, None))
+    flush()
+    return results
+
+
+def bench_results(quick):
+    results = OrderedDict()
+    for keys in (10, 100, 1000) if quick else (10, 100, 1000, 10000):
+        flush()
+        _populate('results', keys, 10 if quick else 50)
+        iterations = 5 if quick else 20
+        results['{}_keys'.format(keys)] = {
+            '_results_dict': latency(
+                lambda i: gimel._results_dict('alephbet', 'results'), iterations),
+            '_experiment_goals': latency(
+                lambda i: gimel._experiment_goals('alephbet', 'results'), iterations)}
+    flush()
+    return results
+
+
+def bench_all(quick):
+    results = OrderedDict()
+    for experiments in (10, 100) if quick else (10, 100, 1000):
+        flush()
+        for ex in range(experiments):
+            gimel.track_batch({'events': list(events(
+                'experiment-{}'.format(ex), 60,
+                goals=('participate', 'signup', 'buy')))}, None)
+        results['{}_experiments'.format(experiments)] = latency(
+            lambda i: gimel.all({'fresh': 'true'}, None), 3 if quick else 10)
+    flush()
+    return results
+
+
+def bench_delete(quick):
+    results = OrderedDict()
+    for keys in (100, 1000) if quick else (100, 1000, 10000):
+        timings = []
+        for _ in range(3):
+            flush()
+            _populate('delete', keys, 10)
+            start = time.time()
+            gimel.delete({'experiment': 'delete'}, None)
+            timings.append((time.time() - start) * 1000)
+        results['{}_keys'.format(keys)] = {'mean_ms': sum(timings) / len(timings),
+                                           'max_ms': max(timings)}
+    flush()
+    return results
+
+
+def bench_connection(quick):
+    return connection.run(500 if quick else 5000)
+
+
+def bench_metrics(quick):
+    count = 2000 if quick else 20000
+    tracked = list(events('metrics', count))
+    results = OrderedDict()
+    for sink in ('null', 'memory', 'emf'):
+        flush()
+        metrics.configure({'sink': sink, 'stream': open(os.devnull, 'w')})
+        results[sink] = latency(lambda i: gimel.track(tracked[i], None), count)
+    metrics.configure(config.get('metrics'))
+    flush()
+    return results
+
+
+def bench_ingest(quick):
+    count = 2000 if quick else 20000
+    tracked = list(events('ingest', count, goals=('participate', 'signup', 'buy')))
+    results = OrderedDict()
+    flush()
+    results['track'] = latency(lambda i: gimel.track(tracked[i], None), count)
+    flush()
+    config['ingest'] = {'max_length': count}
+    gimel._queue = None
+    try:
+        results['track_queued'] = latency(lambda i: gimel.track(tracked[i], None), count)
+        start = time.time()
+        drained = gimel.drain({'batch_size': 1000}, None)['drained']
+        results['drain'] = {'events': drained,
+                            'events_per_sec': drained / (time.time() - start)}
+    finally:
+        config.pop('ingest')
+        gimel._queue = None
+    flush()
+    return results
+
+
+def bench_stats(quick):
+    """ significance stats for experiment/goal/variant cells, with numpy (if
+        installed) and in pure python
+    """
+    rng = random.Random(0)
+    trials = [rng.randint(0, 5000) for _ in range(10000 if quick else 100000)]
+    successes = [rng.randint(0, count) for count in trials]
+    cells = (successes, trials, list(reversed(successes)), list(reversed(trials)))
+    results = OrderedDict()
+    for name, numpy in (('numpy', None), ('python', False)):
+        optional._numpy = numpy
+        if optional.import_numpy() is False and name == 'numpy':
+            continue
+        results[name] = latency(lambda i: stats.cells(*cells), 3 if quick else 10)
+    optional._numpy = None
+    return results
+
+
+def _redis_usec(r, ignore=('cmdstat_pfadd', 'cmdstat_info')):
+    return sum(stat['usec'] for name, stat in r.info('commandstats').items()
+               if name not in ignore)
+
+
+def bench_local_counts(quick):
+    """ counting in redis (PFCOUNT) vs in-process from the raw HyperLogLogs
+        (see `local_counts` in config.json), and parsing a dense sketch.
+        every counter changes before each count, like with ongoing tracking,
+        and `redis_usec` is the redis cpu time of each count
+    """
+    results = OrderedDict()
+    for keys in (10, 100, 1000):
+        flush()
+        _populate('local', keys, 10 if quick else 50)
+        r = gimel._redis('alephbet', 'local')
+        counter_keys = list(r.smembers('alephbet:local:counter_keys'))
+        iterations = 5 if quick else 20
+        results['{}_keys'.format(keys)] = OrderedDict()
+        for mode, count in (('redis', lambda: gimel._counts(r, counter_keys)),
+                            ('local', lambda: gimel._local_counts(gimel._raw_reader(r),
+                                                                  counter_keys))):
+            usec = _redis_usec(r)
+
+            def changed_count(i):
+                gimel._pipelined(r, lambda pipe, key: pipe.pfadd(key, 'changed-{}'.format(i)),
+                                 counter_keys)
+                return count()
+            result = latency(changed_count, iterations)
+            result['redis_usec'] = (_redis_usec(r) - usec) / iterations
+            results['{}_keys'.format(keys)][mode] = result
+    flush()
+    r = gimel._redis('alephbet', 'local')
+    r.pfadd('alephbet:dense', *['uuid-{}'.format(i) for i in range(100000)])
+    dense = gimel._raw_reader(r).get('alephbet:dense')
+    for name, numpy in (('numpy', None), ('python', False)):
+        optional._numpy = numpy
+        if optional.import_numpy() is False and name == 'numpy':
+            continue
+        results['dense_{}'.format(name)] = latency(
+            lambda i: hll.count(hll.registers(dense)), 20 if quick else 200)
+    optional._numpy = None
+    flush()
+    return results
+
+
+def bench_backup(quick):
+    """ `gimel export` and `gimel import` throughput, with and without
+        compression
+    """
+    flush()
+    experiments = ['backup-{}'.format(ex) for ex in range(20 if quick else 200)]
+    for experiment in experiments:
+        gimel.track_batch({'events': list(events(
+            experiment, 1000, goals=('participate', 'signup', 'buy')))}, None)
+
+    def counts():
+        return dict((ex, gimel._results_dict('alephbet', ex)) for ex in experiments)
+    expected = counts()
+    results = OrderedDict()
+    directory = tempfile.mkdtemp()
+    try:
+        for compress in (True, False):
+            output = os.path.join(directory, 'export-{}'.format(compress))
+            start = time.time()
+            records = backup.export('alephbet', output, compress)
+            export_seconds = time.time() - start
+            flush()
+            start = time.time()
+            backup.import_(output)
+            import_seconds = time.time() - start
+            assert counts() == expected
+            results['compressed' if compress else 'uncompressed'] = OrderedDict([
+                ('records', records),
+                ('bytes', os.path.getsize(output)),
+                ('export_records_per_sec', records / export_seconds),
+                ('import_records_per_sec', records / import_seconds)])
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    flush()
+    return results
+
+
+def bench_backfill(quick):
+    """ `gimel backfill` throughput from a JSON lines file, against reading
+        the file and calling track_batch() with batches of 1000 events
+    """
+    flush()
+    experiments = ['backfill-{}'.format(ex) for ex in range(10)]
+    logged = []
+    for experiment in experiments:
+        logged.extend(events(experiment, 10000 if quick else 100000,
+                             goals=('participate', 'signup', 'buy')))
+    # every uuid is logged twice, like retried tracking calls
+    logged.extend(logged[::2])
+    random.shuffle(logged)
+
+    def counts():
+        return dict((ex, gimel._results_dict('alephbet', ex)) for ex in experiments)
+    results = OrderedDict([('events', len(logged))])
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'events.jsonl')
+    try:
+        with open(path, 'w') as f:
+            for event in logged:
+                f.write(json.dumps(event) + '\n')
+        start = time.time()
+        state = backfill.backfill([path], workers=2)
+        results['backfill_events_per_sec'] = state['events'] / (time.time() - start)
+        expected = counts()
+        flush()
+        start = time.time()
+        with open(path) as f:
+            for batch in gimel._chunks((json.loads(line) for line in f), 1000):
+                gimel.track_batch({'events': batch}, None)
+        results['track_batch_events_per_sec'] = len(logged) / (time.time() - start)
+        assert counts() == expected
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    flush()
+    return results
+
+
+def bench_dedupe(quick):
+    """ single `track` calls of retry-heavy traffic, where every event is
+        sent 1 to 3 times in a row, with and without the `dedupe` cache.
+        `redis_calls` is the number of track scripts redis ran
+    """
+    unique = list(events('dedupe', 2000 if quick else 20000,
+                         goals=('participate', 'signup', 'buy')))
+    sent = []
+    for i, event in enumerate(unique):
+        sent.extend([event] * (1 + i % 3))
+    results = OrderedDict()
+    r = gimel._redis('alephbet', 'dedupe')
+    try:
+        for dedupe_config in (None, {'capacity': len(unique), 'ttl': 300}):
+            flush()
+            config['dedupe'] = dedupe_config
+            gimel._recent = None
+            r.config_resetstat()
+            result = _events_per_sec([[event] for event in sent],
+                                     lambda batch: gimel.track(batch[0], None))
+            result['redis_calls'] = r.info('commandstats')['cmdstat_evalsha']['calls']
+            if dedupe_config:
+                result['cache'] = gimel._recent.stats()
+            results['dedupe' if dedupe_config else 'no_dedupe'] = result
+    finally:
+        config.pop('dedupe')
+        gimel._recent = None
+    flush()
+    return results
+
+
+def bench_counters(quick):
+    return counters.run(quick)
+
+
+def bench_shards(quick):
+    return shards.run(REDIS_SERVER[0], quick)
+
+
+def bench_sentinel(quick):
+    return sentinel.run(REDIS_SERVER[0], quick)
+
+
+def bench_boto_clients(quick):
+    return boto_clients.run(20 if quick else 200)
+
+
+SUITES = OrderedDict([
+    ('track', bench_track),
+    ('dedupe', bench_dedupe),
+    ('results', bench_results),
+    ('all', bench_all),
+    ('delete', bench_delete),
+    ('connection', bench_connection),
+    ('metrics', bench_metrics),
+    ('ingest', bench_ingest),
+    ('stats', bench_stats),
+    ('local_counts', bench_local_counts),
+    ('backup', bench_backup),
+    ('backfill', bench_backfill),
+    ('counters', bench_counters),
+    ('shards', bench_shards),
+    ('sentinel', bench_sentinel),
+    ('boto_clients', bench_boto_clients),
+])
+# the redis-server executable, for suites that start their own servers
+REDIS_SERVER = ['redis-server']
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(suites, quick=False, executable='redis-server'):
+    report = OrderedDict([('commit', _commit()),
+                          ('python', platform.python_version()),
+                          ('timestamp', int(time.time())),
+                          ('quick', quick),
+                          ('results', OrderedDict())])
+    REDIS_SERVER[0] = executable
+    with redis_server(executable):
+        report['redis'] = gimel._redis().info()['redis_version']
+        for name in suites:
+            start = time.time()
+            report['results'][name] = SUITES[name](quick)
+            print('[.] {} done in {:.1f}s'.format(name, time.time() - start))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', default=','.join(SUITES),
+                        help='comma-separated benchmarks ({})'.format(
+                            ', '.join(SUITES)))
+    parser.add_argument('--quick', action='store_true',
+                        help='smaller sizes, for a quick sanity check')
+    parser.add_argument('--redis-server', default='redis-server',
+                        help='path to the redis-server executable')
+    parser.add_argument('--output', help='write the JSON report to a file')
+    args = parser.parse_args()
+    report = run(args.only.split(','), args.quick, args.redis_server)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,83 @@
+"""results latency from the master and from the replicas of a sentinel
+service, and how tracking behaves while sentinel fails over (see
+`sentinel` in config.json).
+
+runs a local master, two replicas and a sentinel, then kills the master
+while tracking and reports how long tracking stalled. replication is
+asynchronous, so the few events the master acknowledged but didn't send to
+its replicas yet are lost.
+
+usage:
+
+    $ python benchmarks/sentinel.py --redis-server /usr/local/bin/redis-server
+"""
+from __future__ import print_function
+from collections import OrderedDict
+import argparse
+import json
+import time
+
+from utils import gimel, config, redis_sentinel, use_redis, use_redis_sentinel, latency, events
+
+
+def _results(sentinel_port, read_from_replicas, quick):
+    use_redis_sentinel(sentinel_port, read_from_replicas=read_from_replicas)
+    return latency(lambda i: gimel._results_dict('alephbet', 'sentinel'),
+                   5 if quick else 20)
+
+
+def _failover(topology, quick):
+    use_redis_sentinel(topology['sentinel'], read_from_replicas=True, failover_timeout=30)
+    tracked = list(events('failover', 2000 if quick else 10000))
+    # exact counts, to count the lost events
+    config['exact_threshold'] = len(tracked)
+    timings = []
+    killed = False
+    for i, event in enumerate(tracked):
+        if i == len(tracked) // 2:
+            master, _ = topology['master']
+            master.kill()
+            master.wait()
+            killed = True
+        start = time.time()
+        gimel.track(event, None)
+        timings.append((time.time() - start) * 1000)
+    assert killed
+    # the replicas catch up with the new master
+    time.sleep(1)
+    counted = sum(gimel._results_dict('alephbet', 'failover').values())
+    return OrderedDict([('events', len(tracked)),
+                        ('lost', len(tracked) - counted),
+                        ('max_stall_ms', max(timings)),
+                        ('p50_ms', sorted(timings)[len(timings) // 2])])
+
+
+def run(executable='redis-server', quick=False):
+    redis_config = config.get('redis')
+    exact_threshold = config.get('exact_threshold', 0)
+    results = OrderedDict()
+    try:
+        with redis_sentinel(executable, replicas=2) as topology:
+            use_redis_sentinel(topology['sentinel'])
+            gimel.track_batch({'events': list(events(
+                'sentinel', 10000 if quick else 100000,
+                goals=('participate', 'signup', 'buy')))}, None)
+            # the replicas catch up with the master
+            time.sleep(1)
+            results['results_master'] = _results(topology['sentinel'], False, quick)
+            results['results_replicas'] = _results(topology['sentinel'], True, quick)
+            results['failover'] = _failover(topology, quick)
+    finally:
+        config['exact_threshold'] = exact_threshold
+        if redis_config:
+            use_redis(redis_config.get('host', 'localhost'), redis_config.get('port', 6379))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--redis-server', default='redis-server',
+                        help='path to the redis-server executable')
+    parser.add_argument('--quick', action='store_true')
+    args = parser.parse_args()
+    print(json.dumps(run(args.redis_server, args.quick), indent=2))
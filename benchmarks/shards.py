@@ -0,0 +1,70 @@
+"""track throughput and `all` latency with the experiments sharded across
+1, 2 and 4 local redis-servers (see `redis_shards` in config.json).
+
+a single benchmark process can't saturate more than one redis, so the
+interesting numbers are how the experiments and the redis cpu time are
+split between the shards.
+
+usage:
+
+    $ python benchmarks/shards.py --redis-server /usr/local/bin/redis-server
+"""
+from __future__ import print_function
+from collections import OrderedDict
+import argparse
+import json
+import time
+
+from utils import gimel, config, redis_servers, use_redis, use_redis_shards, latency, events
+
+EXPERIMENTS = 100
+
+
+def _cpu(r):
+    info = r.info('cpu')
+    return info['used_cpu_sys'] + info['used_cpu_user']
+
+
+def _run_shards(executable, count, quick):
+    with redis_servers(executable, count) as ports:
+        use_redis_shards(ports)
+        batches = [list(events('shards-{}'.format(ex), 100 if quick else 1000,
+                               goals=('participate', 'signup', 'buy')))
+                   for ex in range(EXPERIMENTS)]
+        start = time.time()
+        for batch in batches:
+            gimel.track_batch({'events': batch}, None)
+        tracked = sum(len(batch) for batch in batches)
+        result = OrderedDict([
+            ('events_per_sec', tracked / (time.time() - start)),
+            ('all', latency(lambda i: gimel.all({'fresh': 'true'}, None),
+                            3 if quick else 10)),
+            ('experiments_per_shard', [r.scard('alephbet:experiments')
+                                       for r in gimel._redis_clients()]),
+            # the redis cpu time each shard spent, i.e. how the load is split
+            ('redis_cpu_seconds', [_cpu(r) for r in gimel._redis_clients()])])
+        # every experiment is stored on exactly one shard
+        assert sum(result['experiments_per_shard']) == EXPERIMENTS
+        assert len(gimel.all({}, None)) == EXPERIMENTS + 1
+    return result
+
+
+def run(executable='redis-server', quick=False):
+    redis_config = config.get('redis')
+    results = OrderedDict()
+    try:
+        for count in (1, 2, 4):
+            results['{}_shards'.format(count)] = _run_shards(executable, count, quick)
+    finally:
+        if redis_config:
+            use_redis(redis_config.get('host', 'localhost'), redis_config.get('port', 6379))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--redis-server', default='redis-server',
+                        help='path to the redis-server executable')
+    parser.add_argument('--quick', action='store_true')
+    args = parser.parse_args()
+    print(json.dumps(run(args.redis_server, args.quick), indent=2))
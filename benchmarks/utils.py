@@ -0,0 +1,162 @@
+""" helpers shared by the benchmarks: a throwaway redis-server and timing """
+from __future__ import print_function
+from contextlib import contextmanager
+import os
+import socket
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'gimel', 'vendor'))
+sys.path.insert(0, ROOT)
+
+import redis  # noqa
+from gimel import gimel  # noqa
+from gimel.config import config  # noqa
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def use_redis(host, port):
+    """ points gimel at the given redis and drops the current pool """
+    config['redis'] = {'host': host, 'port': port}
+    config.pop('redis_shards', None)
+    gimel._clients = None
+
+
+def use_redis_shards(ports):
+    """ shards gimel across the given local redis ports """
+    config['redis_shards'] = [{'host': '127.0.0.1', 'port': port} for port in ports]
+    gimel._clients = None
+
+
+def use_redis_sentinel(port, service_name='gimel', **options):
+    """ points gimel at the master (and replicas) of a sentinel service """
+    sentinel = dict(sentinels=[['127.0.0.1', port]], service_name=service_name, **options)
+    config['redis'] = {'sentinel': sentinel}
+    config.pop('redis_shards', None)
+    gimel._clients = None
+
+
+def _start_redis(executable, *arguments):
+    port = _free_port()
+    process = subprocess.Popen(
+        [executable, '--port', str(port), '--save', '', '--appendonly', 'no'] + list(arguments),
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    client = redis.Redis(port=port)
+    for _ in range(100):
+        try:
+            client.ping()
+            break
+        except redis.ConnectionError:
+            time.sleep(0.05)
+    return process, port
+
+
+@contextmanager
+def redis_servers(executable='redis-server', count=1):
+    """ runs `count` redis-servers without persistence on free ports and
+        yields their ports
+    """
+    processes = []
+    try:
+        for _ in range(count):
+            processes.append(_start_redis(executable))
+        yield [port for process, port in processes]
+    finally:
+        for process, port in processes:
+            process.terminate()
+            process.wait()
+
+
+@contextmanager
+def redis_server(executable='redis-server'):
+    """ runs a redis-server without persistence on a free port and points
+        gimel at it
+    """
+    with redis_servers(executable) as ports:
+        use_redis('127.0.0.1', ports[0])
+        yield ports[0]
+
+
+@contextmanager
+def redis_sentinel(executable='redis-server', replicas=1, service_name='gimel'):
+    """ runs a master, `replicas` replicas and a sentinel monitoring them
+        (which fails over half a second after the master is gone), and
+        yields {'master': (process, port), 'replicas': [...], 'sentinel': port}
+    """
+    directory = tempfile.mkdtemp()
+    processes = []
+    try:
+        processes.append(_start_redis(executable))
+        master_port = processes[0][1]
+        for _ in range(replicas):
+            processes.append(_start_redis(executable, '--replicaof', '127.0.0.1',
+                                          str(master_port)))
+        sentinel_port = _free_port()
+        sentinel_config = os.path.join(directory, 'sentinel.conf')
+        with open(sentinel_config, 'w') as f:
+            f.write('port {0}\n'
+                    'sentinel monitor {1} 127.0.0.1 {2} 1\n'
+                    'sentinel down-after-milliseconds {1} 500\n'
+                    'sentinel failover-timeout {1} 5000\n'.format(
+                        sentinel_port, service_name, master_port))
+        sentinel = subprocess.Popen([executable, sentinel_config, '--sentinel'],
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        processes.append((sentinel, sentinel_port))
+        # wait until the sentinel knows the replicas
+        client = redis.Redis(port=sentinel_port)
+        for _ in range(200):
+            try:
+                if len(client.sentinel_slaves(service_name)) == replicas:
+                    break
+            except (redis.ConnectionError, redis.ResponseError):
+                pass
+            time.sleep(0.05)
+        yield {'master': processes[0], 'replicas': processes[1:-1],
+               'sentinel': sentinel_port}
+    finally:
+        for process, port in processes:
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
+        shutil.rmtree(directory)
+
+
+def flush():
+    for r in gimel._redis_clients():
+        r.flushall()
+
+
+def latency(func, iterations):
+    """ calls func `iterations` times and returns latency stats in ms """
+    timings = []
+    for i in range(iterations):
+        start = time.time()
+        func(i)
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    return {'iterations': iterations,
+            'mean_ms': sum(timings) / len(timings),
+            'p50_ms': timings[len(timings) // 2],
+            'p99_ms': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+            'max_ms': timings[-1]}
+
+
+def events(experiment, count, goals=('participate',), variants=('red', 'blue'),
+           namespace='alephbet', offset=0):
+    """ yields `count` tracking events spread over goals and variants """
+    for i in range(offset, offset + count):
+        yield {'namespace': namespace, 'experiment': experiment,
+               'event': goals[i % len(goals)],
+               'variant': variants[(i // len(goals)) % len(variants)],
+               'uuid': 'uuid-{}'.format(i)}
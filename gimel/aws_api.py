@@ -1,26 +1,135 @@
 import boto3
 import botocore.session
 import jmespath
+import random
+import threading
+import time
+from botocore.exceptions import ClientError
+from collections import OrderedDict
 from functools import partial
 
+# errors worth retrying with exponential backoff
+RETRYABLE_ERRORS = ('Throttling', 'ThrottlingException',
+                    'TooManyRequestsException', 'RequestLimitExceeded',
+                    'ResourceConflictException')
+MAX_ATTEMPTS = 6
+BACKOFF_SECONDS = 0.5
+QUERY_CACHE_SIZE = 256
 
-def boto_session():
-    return boto3.session.Session()
+_sessions = {}
+_clients = {}
+_queries = OrderedDict()
+_lock = threading.Lock()
+
+
+def boto_session(profile_name=None):
+    """ returns the shared boto session for the profile. loading the service
+        models is the slow part of creating clients, and a session keeps
+        them after the first one
+    """
+    if profile_name not in _sessions:
+        with _lock:
+            if profile_name not in _sessions:
+                _sessions[profile_name] = boto3.session.Session(profile_name=profile_name)
+    return _sessions[profile_name]
+
+
+def client(service, region_name=None, profile_name=None):
+    """ returns a boto client for (service, region, profile). clients are
+        thread-safe, so a single one is shared by all calls (sessions aren't,
+        so creating them is serialized)
+    """
+    key = (service, region_name, profile_name)
+    if key not in _clients:
+        session = boto_session(profile_name)
+        with _lock:
+            if key not in _clients:
+                _clients[key] = session.client(service, region_name=region_name)
+    return _clients[key]
+
+
+def compiled(query):
+    """ returns the compiled jmespath expression, keeping the most recently
+        used QUERY_CACHE_SIZE of them
+    """
+    with _lock:
+        expression = _queries.pop(query, None)
+        if expression is None:
+            expression = jmespath.compile(query)
+        _queries[query] = expression
+        if len(_queries) > QUERY_CACHE_SIZE:
+            _queries.popitem(last=False)
+    return expression
+
+
+def _call(service_client, action, kwargs):
+    if service_client.can_paginate(action):
+        paginator = service_client.get_paginator(action)
+        return paginator.paginate(**kwargs).build_full_result()
+    return getattr(service_client, action)(**kwargs)
+
+
+def _retrying(func, *args):
+    """ calls `func(*args)`, retrying RETRYABLE_ERRORS with exponential
+        backoff
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return func(*args)
+        except ClientError as error:
+            code = error.response.get('Error', {}).get('Code')
+            if code not in RETRYABLE_ERRORS or attempt == MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(BACKOFF_SECONDS * 2 ** attempt * (1 + random.random()))
 
 
 def aws(service, action, **kwargs):
-    client = boto_session().client(service)
+    service_client = client(service)
     query = kwargs.pop('query', None)
-    if client.can_paginate(action):
-        paginator = client.get_paginator(action)
-        result = paginator.paginate(**kwargs).build_full_result()
-    else:
-        result = getattr(client, action)(**kwargs)
+    result = _retrying(_call, service_client, action, kwargs)
     if query:
-        result = jmespath.compile(query).search(result)
+        result = compiled(query).search(result)
     return result
 
 
+def pages(service, action, query=None, **kwargs):
+    """ yields the pages of a paginated call as they are fetched, or the
+        query result for each page. throttled pages are retried like aws()
+        calls, which fetches the pages before them again
+    """
+    paginator = client(service).get_paginator(action)
+    state = {'iterator': iter(paginator.paginate(**kwargs)), 'yielded': 0, 'skip': 0}
+
+    def next_page():
+        try:
+            while state['skip']:
+                next(state['iterator'])
+                state['skip'] -= 1
+            return next(state['iterator'], None)
+        except ClientError:
+            # a page iterator stops after an error, so the next attempt
+            # starts over and skips the pages that were already yielded
+            state['iterator'] = iter(paginator.paginate(**kwargs))
+            state['skip'] = state['yielded']
+            raise
+
+    while True:
+        page = _retrying(next_page)
+        if page is None:
+            return
+        state['yielded'] += 1
+        yield compiled(query).search(page) if query else page
+
+
+def first(service, action, query, **kwargs):
+    """ returns the first non-empty query result, without fetching the
+        pages after it
+    """
+    for result in pages(service, action, query, **kwargs):
+        if result is not None:
+            return result
+
+
 def region():
     return boto_session().region_name
 
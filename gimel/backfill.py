@@ -0,0 +1,338 @@
+from __future__ import division, print_function
+import csv
+import gzip
+import json
+import multiprocessing
+import os
+import time
+import traceback
+import zlib
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+try:
+    from gimel import gimel
+    from gimel.config import config
+except ImportError:
+    import gimel
+    from config import config
+
+# lines sent to a worker at a time
+BATCH_SIZE = 5000
+# unique uuids a worker aggregates before tracking them
+FLUSH_SIZE = 100000
+# lines between checkpoints. workers track everything they aggregated
+# before the checkpoint is saved
+CHECKPOINT_LINES = 500000
+# line batches waiting for each worker, which bounds the memory of the reader
+QUEUE_SIZE = 8
+EVENT_FIELDS = ('experiment', 'variant', 'event', 'uuid')
+
+
+def _format(path, input_format=None):
+    if input_format:
+        return input_format
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith('.csv') else 'jsonl'
+
+
+def _lines(path, input_format, offset=0):
+    """ yields (line, offset after the line) for every line of the file from
+        `offset`. the header of CSV files is returned first with offset None
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        if input_format == 'csv':
+            header = f.readline()
+            yield header, None
+            offset = max(offset, len(header))
+        f.seek(offset)
+        for line in iter(f.readline, b''):
+            offset += len(line)
+            yield line, offset
+
+
+def _parse(line, fields=None):
+    """ returns the event of a JSON or CSV line, or None when it's invalid """
+    line = line.decode('utf-8').strip()
+    if not line:
+        return None
+    try:
+        if fields:
+            event = dict(zip(fields, next(csv.reader([line]))))
+        else:
+            event = json.loads(line)
+        if all(event[field] for field in EVENT_FIELDS):
+            return event
+    except (ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _track(pending):
+    """ tracks the aggregated {(bucket, namespace, experiment, goal, variant):
+        (timestamp, uuids)}, with all the counters of a time bucket together
+    """
+    by_bucket = {}
+    for (bucket, namespace, experiment, goal, variant), (timestamp, uuids) in pending.items():
+        key = gimel._counter_key(namespace, experiment, goal, variant)
+        by_bucket.setdefault(bucket, (timestamp, {}))[1][(namespace, experiment, key)] = list(uuids)
+    for timestamp, counters in by_bucket.values():
+        gimel._track_counters(counters, timestamp)
+
+
+def _owner(owners, key, workers):
+    """ the worker aggregating the counter key of `key`, (bucket, namespace,
+        experiment, goal, variant), which is the same in every process
+    """
+    counter = key[1:]
+    owner = owners.get(counter)
+    if owner is None:
+        counter_key = gimel._counter_key(*counter).encode('utf-8')
+        owner = owners[counter] = zlib.crc32(counter_key) % workers
+    return owner
+
+
+def _merge(pending, routed):
+    """ merges {key: (timestamp, uuids)} into `pending`, returning the
+        number of uuids added
+    """
+    size = 0
+    for key, (timestamp, uuids) in routed.items():
+        size += len(uuids)
+        pending.setdefault(key, (timestamp, set()))[1].update(uuids)
+    return size
+
+
+def _worker(index, namespace, inboxes, slots, acks):
+    """ parses the lines it gets from the reader and hands every event to the
+        worker owning its counter key, so each key is aggregated (and its
+        uuids deduplicated) in one worker. a worker tracks what it aggregated
+        once it holds FLUSH_SIZE uuids, or once every worker parsed the lines
+        sent before a flush. tracking sends up to SCRIPT_MAX_UUIDS uuids per
+        PFADD, in one pipeline per shard
+    """
+    # every process connects on its own
+    gimel._clients = None
+    bucket_config = config.get('buckets')
+    resolution = bucket_config and bucket_config.get('resolution', 'day')
+    sampling = config.get('sampling')
+    workers = len(inboxes)
+    inbox = inboxes[index]
+    owners = {}
+    pending = {}
+    size = events = skipped = parsed = 0
+    try:
+        while True:
+            message = inbox.get()
+            if message[0] == 'lines':
+                _, fields, lines = message
+                routed = [{} for _ in range(workers)]
+                for line in lines:
+                    event = _parse(line, fields)
+                    if event is None:
+                        skipped += 1
+                        continue
+                    experiment = event['experiment']
+                    if sampling and not gimel._in_sample(
+                            experiment, event['uuid'],
+                            gimel._sampling(experiment).get('rate', 1)):
+                        continue
+                    timestamp = bucket = None
+                    if resolution:
+                        # without a timestamp, the event would land in the
+                        # current bucket and inflate the windowed counts
+                        at = event.get('timestamp') or event.get('at')
+                        if not at:
+                            skipped += 1
+                            continue
+                        try:
+                            timestamp = gimel._parse_time(str(at))
+                        except ValueError:
+                            skipped += 1
+                            continue
+                        bucket = gimel._bucket(timestamp, resolution)
+                    key = (bucket, event.get('namespace') or namespace, experiment,
+                           event['event'], event['variant'])
+                    owner = routed[_owner(owners, key, workers)]
+                    owner.setdefault(key, (timestamp, set()))[1].add(event['uuid'])
+                    events += 1
+                slots.release()
+                for worker, events_of_worker in enumerate(routed):
+                    if worker == index:
+                        size += _merge(pending, events_of_worker)
+                    elif events_of_worker:
+                        inboxes[worker].put(('events', events_of_worker))
+            elif message[0] == 'events':
+                size += _merge(pending, message[1])
+            elif message[0] == 'flush':
+                # queues are FIFO per sender, so once a worker got the
+                # 'parsed' of every worker it has all the events before the flush
+                for worker_inbox in inboxes:
+                    worker_inbox.put(('parsed',))
+                continue
+            elif message[0] == 'parsed':
+                parsed += 1
+            elif message[0] == 'stop':
+                return
+            if size < FLUSH_SIZE and parsed < workers:
+                continue
+            _track(pending)
+            pending = {}
+            size = 0
+            if parsed == workers:
+                acks.put(('flushed', events, skipped))
+                events = skipped = parsed = 0
+    except Exception:
+        acks.put(('error', None, traceback.format_exc()))
+
+
+class _Pool(object):
+    """ worker processes, each with its own inbox for line batches from the
+        reader and events from the other workers. inboxes are unbounded, so
+        workers never block on each other, and `slots` bounds the line
+        batches waiting in them instead
+    """
+
+    def __init__(self, workers, namespace):
+        self.inboxes = [multiprocessing.Queue() for _ in range(workers)]
+        self.slots = multiprocessing.Semaphore(workers * QUEUE_SIZE)
+        self.acks = multiprocessing.Queue()
+        self.processes = [multiprocessing.Process(
+            target=_worker, args=(index, namespace, self.inboxes, self.slots, self.acks))
+            for index in range(workers)]
+        for process in self.processes:
+            process.daemon = True
+            process.start()
+
+    def _check(self):
+        for process in self.processes:
+            if process.exitcode is not None:
+                try:
+                    _, _, error = self.acks.get_nowait()
+                except Empty:
+                    error = 'exit code {0}'.format(process.exitcode)
+                raise RuntimeError('a backfill worker failed: {0}'.format(error))
+
+    def put_lines(self, worker, fields, lines):
+        while not self.slots.acquire(timeout=1):
+            self._check()
+        self.inboxes[worker].put(('lines', fields, lines))
+
+    def flush(self):
+        """ waits until every worker tracked everything it got, and returns
+            the number of events tracked and lines skipped since the last flush
+        """
+        for inbox in self.inboxes:
+            inbox.put(('flush',))
+        events = skipped = flushed = 0
+        while flushed < len(self.inboxes):
+            try:
+                kind, flushed_events, value = self.acks.get(timeout=1)
+            except Empty:
+                self._check()
+                continue
+            if kind == 'error':
+                raise RuntimeError('a backfill worker failed: {0}'.format(value))
+            flushed += 1
+            events += flushed_events
+            skipped += value
+        return events, skipped
+
+    def close(self):
+        for inbox in self.inboxes:
+            inbox.put(('stop',))
+        for process in self.processes:
+            process.join()
+
+    def terminate(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        # lines left in the inboxes would block the exit otherwise
+        for inbox in self.inboxes:
+            inbox.cancel_join_thread()
+
+
+def _save_checkpoint(checkpoint_file, state):
+    with open(checkpoint_file + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.rename(checkpoint_file + '.tmp', checkpoint_file)
+
+
+def backfill(paths, namespace='alephbet', workers=None, input_format=None,
+             checkpoint_file=None, restart=False, progress=None):
+    """ tracks the events logged in `paths`: JSON lines or CSV files (with a
+        header), optionally gzipped, with experiment, variant, event and uuid
+        fields, and optional namespace and timestamp (used for the time
+        buckets) fields. with buckets configured, events without a valid
+        timestamp are skipped.
+
+        the files are read line by line and the lines are sent in batches to
+        `workers` processes, which parse them. the uuids of every counter key
+        are aggregated by one worker, picked by a hash of the key. every
+        CHECKPOINT_LINES lines, all workers track what they aggregated, and
+        the position in the files is saved to `checkpoint_file` ({first
+        path}.checkpoint by default). an
+        interrupted backfill continues from there, unless `restart`.
+        tracking events again is harmless, so events after the checkpoint
+        may be tracked twice. sample rates apply, but not rate limits.
+        `progress(state)` is called after each checkpoint. returns the state:
+        the number of events and skipped (invalid) lines, and the throughput
+    """
+    workers = workers or multiprocessing.cpu_count()
+    checkpoint_file = checkpoint_file or paths[0] + '.checkpoint'
+    state = {'done': [], 'path': None, 'offset': 0, 'events': 0, 'skipped': 0}
+    if os.path.exists(checkpoint_file) and not restart:
+        with open(checkpoint_file) as f:
+            state = json.load(f)
+    start = time.time()
+    resumed_events = state['events']
+    pool = _Pool(workers, namespace)
+    batches = [[] for _ in range(workers)]
+
+    def checkpoint(path, offset, fields):
+        for worker, batch in enumerate(batches):
+            if batch:
+                pool.put_lines(worker, fields, batch)
+                batches[worker] = []
+        events, skipped = pool.flush()
+        state['events'] += events
+        state['skipped'] += skipped
+        state.update(path=path, offset=offset)
+        state['seconds'] = time.time() - start
+        state['events_per_sec'] = (state['events'] - resumed_events) / state['seconds']
+        _save_checkpoint(checkpoint_file, state)
+        if progress:
+            progress(state)
+
+    try:
+        for path in paths:
+            if path in state['done']:
+                continue
+            offset = state['offset'] if path == state['path'] else 0
+            fields = None
+            worker = 0
+            lines = 0
+            for line, offset in _lines(path, _format(path, input_format), offset):
+                if offset is None:
+                    fields = next(csv.reader([line.decode('utf-8')]))
+                    continue
+                batch = batches[worker]
+                batch.append(line)
+                if len(batch) >= BATCH_SIZE:
+                    pool.put_lines(worker, fields, batch)
+                    batches[worker] = []
+                    worker = (worker + 1) % workers
+                lines += 1
+                if lines % CHECKPOINT_LINES == 0:
+                    checkpoint(path, offset, fields)
+            state['done'].append(path)
+            checkpoint(None, 0, fields)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    os.remove(checkpoint_file)
+    return state
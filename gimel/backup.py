@@ -0,0 +1,244 @@
+from __future__ import print_function
+import json
+import os
+import struct
+import time
+import zlib
+try:
+    from gimel import gimel
+    from gimel.config import config
+except ImportError:
+    import gimel
+    from config import config
+
+MAGIC = b'GIMEL-EXPORT\n'
+FORMAT_VERSION = 1
+# records are written in chunks of about CHUNK_SIZE bytes (before
+# compression), each compressed on its own, so memory use doesn't grow with
+# the namespace and an import can resume at any chunk
+CHUNK_SIZE = 1 << 20
+# keys per SSCAN / SCAN call and per pipeline
+SCAN_COUNT = 500
+# record kinds: the raw value (and ttl) of a string key, i.e. a HyperLogLog,
+# or members to add to a set
+VALUE = b'V'
+MEMBERS = b'M'
+
+
+def _pack_string(value):
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return struct.pack('>I', len(value)) + value
+
+
+def _unpack_string(data, offset):
+    length, = struct.unpack_from('>I', data, offset)
+    offset += 4
+    return data[offset:offset + length], offset + length
+
+
+class _ChunkWriter(object):
+    """ writes records in length-prefixed (and optionally zlib compressed)
+        chunks. a zero-length chunk marks the end of the export
+    """
+
+    def __init__(self, stream, compress):
+        self.stream = stream
+        self.compress = compress
+        self.records = []
+        self.size = 0
+        self.written = 0
+
+    def add(self, record):
+        self.records.append(record)
+        self.size += len(record)
+        if self.size >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        chunk = b''.join(self.records)
+        if self.compress:
+            chunk = zlib.compress(chunk)
+        self.stream.write(struct.pack('>I', len(chunk)) + chunk)
+        self.written += len(self.records)
+        self.records = []
+        self.size = 0
+
+    def close(self):
+        self.flush()
+        self.stream.write(struct.pack('>I', 0))
+
+
+def _value_record(experiment, key, value, ttl):
+    return b''.join([VALUE, _pack_string(experiment), _pack_string(key),
+                     struct.pack('>q', ttl), _pack_string(value)])
+
+
+def _members_record(experiment, key, members):
+    return b''.join([MEMBERS, _pack_string(experiment), _pack_string(key),
+                     struct.pack('>I', len(members))] + [_pack_string(m) for m in members])
+
+
+def _records(chunk):
+    """ yields (kind, experiment, key, value or members, ttl) """
+    offset = 0
+    while offset < len(chunk):
+        kind = chunk[offset:offset + 1]
+        experiment, offset = _unpack_string(chunk, offset + 1)
+        key, offset = _unpack_string(chunk, offset)
+        experiment, key = experiment.decode('utf-8'), key.decode('utf-8')
+        if kind == VALUE:
+            ttl, = struct.unpack_from('>q', chunk, offset)
+            value, offset = _unpack_string(chunk, offset + 8)
+            yield kind, experiment, key, value, ttl
+        elif kind == MEMBERS:
+            count, = struct.unpack_from('>I', chunk, offset)
+            offset += 4
+            members = []
+            for _ in range(count):
+                member, offset = _unpack_string(chunk, offset)
+                members.append(member.decode('utf-8'))
+            yield kind, experiment, key, members, -1
+        else:
+            raise ValueError('unknown record kind {0!r}'.format(kind))
+
+
+def _export_values(r, writer, keys_experiments):
+    """ adds the raw value and ttl of every (key, experiment) that is still a
+        string (i.e. a HyperLogLog) to the export
+    """
+    raw = gimel._raw_reader(r)
+
+    def get(pipe, key):
+        pipe.get(key)
+        pipe.pttl(key)
+    results = gimel._pipelined(raw, get, [key for key, _ in keys_experiments])
+    for (key, experiment), value, ttl in zip(keys_experiments, results[::2], results[1::2]):
+        if value is not None:
+            # PTTL is None for keys without a ttl
+            writer.add(_value_record(experiment, key, value, ttl or -1))
+
+
+def _export_experiment(r, writer, namespace, experiment):
+    """ adds the experiment, its counter keys index and its counters to the
+        export, and returns the number of counters. exact counters (sets)
+        are exported as their members
+    """
+    writer.add(_members_record(experiment, '{0}:experiments'.format(namespace), [experiment]))
+    counters_set_key = '{0}:{1}:counter_keys'.format(namespace, experiment)
+    counter_keys_index = config.get('counter_keys_index', False)
+    exported = 0
+    for keys in gimel._chunks(r.sscan_iter(counters_set_key, count=SCAN_COUNT), SCAN_COUNT):
+        writer.add(_members_record(experiment, counters_set_key, keys))
+        if counter_keys_index:
+            writer.add(_members_record(experiment, '{0}:counter_keys'.format(namespace), keys))
+        types = gimel._pipelined(r, lambda pipe, key: pipe.type(key), keys)
+        _export_values(r, writer, [(key, experiment) for key, key_type in zip(keys, types)
+                                   if key_type == 'string'])
+        for key, key_type in zip(keys, types):
+            if key_type == 'set':
+                for members in gimel._chunks(r.sscan_iter(key, count=SCAN_COUNT), SCAN_COUNT):
+                    writer.add(_members_record(experiment, key, members))
+        exported += len(keys)
+    return exported
+
+
+def export(namespace, output, compress=True, progress=None):
+    """ streams the experiments of the namespace, their counters and their
+        time buckets from every redis node to the `output` file, using
+        SSCAN / SCAN and pipelined GETs. `progress(experiment, counters)` is
+        called after each experiment. returns the number of records
+    """
+    header = json.dumps({'version': FORMAT_VERSION, 'namespace': namespace,
+                         'compress': compress, 'created': time.time()}).encode('utf-8')
+    with open(output, 'wb') as stream:
+        stream.write(MAGIC + _pack_string(header))
+        writer = _ChunkWriter(stream, compress)
+        for r in gimel._redis_clients():
+            experiments_key = '{0}:experiments'.format(namespace)
+            for experiment in r.sscan_iter(experiments_key, count=SCAN_COUNT):
+                counters = _export_experiment(r, writer, namespace, experiment)
+                if progress:
+                    progress(experiment, counters)
+            # buckets aren't indexed, so they are found with one SCAN per node
+            prefix = '{0}:buckets:'.format(namespace)
+            pattern = gimel._escape_pattern(prefix) + '*'
+            for keys in gimel._chunks(r.scan_iter(match=pattern, count=SCAN_COUNT), SCAN_COUNT):
+                # {namespace}:buckets:{experiment}:{goal}:{variant}:{bucket}
+                _export_values(r, writer, [(key, key[len(prefix):].rsplit(':', 3)[0])
+                                           for key in keys])
+        writer.close()
+    return writer.written
+
+
+def _read_header(stream):
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise ValueError('not a gimel export')
+    length, = struct.unpack('>I', stream.read(4))
+    header = json.loads(stream.read(length).decode('utf-8'))
+    if header['version'] > FORMAT_VERSION:
+        raise ValueError('unsupported export version {0}'.format(header['version']))
+    return header
+
+
+def _import_records(r, records):
+    def restore(pipe, record):
+        kind, _, key, value, ttl = record
+        if kind == VALUE:
+            pipe.set(key, value, px=ttl if ttl > 0 else None)
+        else:
+            pipe.sadd(key, *value)
+    gimel._pipelined(r, restore, records)
+
+
+def _save_progress(progress_file, offset, imported):
+    with open(progress_file + '.tmp', 'w') as f:
+        json.dump({'offset': offset, 'records': imported}, f)
+    os.rename(progress_file + '.tmp', progress_file)
+
+
+def import_(input_file, restart=False, progress=None):
+    """ imports an export into the configured redis node(s), routing every
+        experiment to its shard. imported values replace existing keys, and
+        members are added to existing sets. the offset of the next chunk is
+        saved to `{input_file}.progress` after each chunk, so an interrupted
+        import continues from there (unless `restart`).
+        `progress(records)` is called after each chunk. returns the number of
+        records imported
+    """
+    progress_file = input_file + '.progress'
+    state = {'offset': None, 'records': 0}
+    if os.path.exists(progress_file) and not restart:
+        with open(progress_file) as f:
+            state = json.load(f)
+    imported = state['records']
+    with open(input_file, 'rb') as stream:
+        header = _read_header(stream)
+        namespace = header['namespace']
+        if state['offset']:
+            stream.seek(state['offset'])
+        while True:
+            length_bytes = stream.read(4)
+            if len(length_bytes) < 4:
+                raise ValueError('the export is truncated')
+            length, = struct.unpack('>I', length_bytes)
+            if not length:
+                break
+            chunk = stream.read(length)
+            if len(chunk) < length:
+                raise ValueError('the export is truncated')
+            if header['compress']:
+                chunk = zlib.decompress(chunk)
+            shards = {}
+            for record in _records(chunk):
+                shards.setdefault(gimel._redis(namespace, record[1]), []).append(record)
+            gimel._fan_out(_import_records, list(shards.items()))
+            imported += sum(len(records) for records in shards.values())
+            _save_progress(progress_file, stream.tell(), imported)
+            if progress:
+                progress(imported)
+    if os.path.exists(progress_file):
+        os.remove(progress_file)
+    return imported
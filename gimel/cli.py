@@ -1,13 +1,24 @@
 import click
 import logging
+import time
 try:
+    from gimel import backfill as backfill_events
+    from gimel import backup
     from gimel import logger
-    from gimel.deploy import run, js_code_snippet, preflight_checks, dashboard_url
+    from gimel.deploy import (run, js_code_snippet, preflight_checks, dashboard_url,
+                              prepare_zip, import_time_report, DEPLOY_WORKERS)
     from gimel.config import config, config_filename, generate_config
+    from gimel import server
+    from gimel.gimel import pending_deletes, reclaim_deletes, drain as drain_queue
 except ImportError:
+    import backfill as backfill_events
+    import backup
     import logger
-    from deploy import run, js_code_snippet, preflight_checks, dashboard_url
+    from deploy import (run, js_code_snippet, preflight_checks, dashboard_url,
+                        prepare_zip, import_time_report, DEPLOY_WORKERS)
     from config import config, config_filename, generate_config
+    import server
+    from gimel import pending_deletes, reclaim_deletes, drain as drain_queue
 
 logger = logger.setup()
 
@@ -27,16 +38,31 @@ def preflight():
 
 @cli.command()
 @click.option('--preflight/--no-preflight', default=True)
-def deploy(preflight):
+@click.option('--precompile', is_flag=True,
+              help='add .pyc files to the lambda package')
+@click.option('--workers', default=DEPLOY_WORKERS, help='number of parallel deploy steps')
+def deploy(preflight, precompile, workers):
     if preflight:
         logger.info('running preflight checks')
         if not preflight_checks():
             return
     logger.info('deploying')
-    run()
+    run(precompile, workers)
     js_code_snippet()
 
 
+@cli.command('import-time')
+@click.option('--precompile', is_flag=True,
+              help='add .pyc files to the lambda package')
+@click.option('--top', default=20, help='number of modules to show')
+def import_time(precompile, top):
+    prepare_zip(precompile)
+    report = import_time_report()
+    logger.info('{:>10} {:>10}  module'.format('self(us)', 'total(us)'))
+    for self_us, cumulative_us, module in report[:top]:
+        logger.info('{:>10} {:>10}  {}'.format(self_us, cumulative_us, module))
+
+
 @cli.command()
 def configure():
     if not config:
@@ -51,5 +77,91 @@ def dashboard(namespace):
     click.launch(dashboard_url(namespace))
 
 
+@cli.command()
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8000)
+@click.option('--workers', default=1, help='number of worker processes')
+def serve(host, port, workers):
+    logger.info('serving gimel on http://{}:{}'.format(host, port))
+    server.serve(host, port, workers)
+
+
+@cli.command()
+@click.option('--namespace', default='alephbet')
+@click.option('--status', is_flag=True, help='only show the pending deletes')
+def reclaim(namespace, status):
+    if status:
+        for tombstone, state in sorted(pending_deletes(namespace).items()):
+            logger.info('{experiment}: {deleted} keys deleted'.format(**state))
+        return
+    deleted = reclaim_deletes(
+        namespace, lambda experiment, count: logger.info(
+            '{}: {} keys deleted'.format(experiment, count)))
+    logger.info('reclaimed {} keys'.format(deleted))
+
+
+@cli.command()
+@click.option('--batch-size', default=None, type=int, help='events per batch')
+@click.option('--follow', is_flag=True, help='keep draining new events')
+@click.option('--interval', default=1.0, help='seconds between drains with --follow')
+def drain(batch_size, follow, interval):
+    if not config.get('ingest'):
+        logger.error('ingest is not configured in {}'.format(config_filename))
+        return
+    while True:
+        result = drain_queue({'batch_size': batch_size, 'max_seconds': 60}, None)
+        logger.info('drained {drained} events ({invalid} invalid). {queued} queued, '
+                    'lag {lag_seconds:.1f}s'.format(**result))
+        if not follow:
+            return
+        if not result['drained']:
+            time.sleep(interval)
+
+
+@cli.command('export')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+@click.option('--namespace', default='alephbet')
+@click.option('--compress/--no-compress', default=True, help='zlib compress the chunks')
+def export_command(output, namespace, compress):
+    start = time.time()
+    records = backup.export(namespace, output, compress, lambda experiment, counters: logger.info(
+        '{}: {} counters exported'.format(experiment, counters)))
+    logger.info('exported {} records to {} in {:.1f}s'.format(
+        records, output, time.time() - start))
+
+
+@cli.command('import')
+@click.argument('input_file', metavar='INPUT', type=click.Path(exists=True, dir_okay=False))
+@click.option('--restart', is_flag=True,
+              help='start from the beginning, instead of resuming an interrupted import')
+def import_command(input_file, restart):
+    start = time.time()
+    records = backup.import_(input_file, restart, lambda imported: logger.debug(
+        '{} records imported'.format(imported)))
+    logger.info('imported {} records from {} in {:.1f}s'.format(
+        records, input_file, time.time() - start))
+
+
+@cli.command()
+@click.argument('paths', metavar='FILE...', nargs=-1, required=True,
+                type=click.Path(exists=True, dir_okay=False))
+@click.option('--namespace', default='alephbet',
+              help='namespace of the events without a namespace field')
+@click.option('--workers', type=int, help='worker processes (one per cpu by default)')
+@click.option('--format', 'input_format', type=click.Choice(['jsonl', 'csv']),
+              help='the file format (by default from the file extension)')
+@click.option('--checkpoint', 'checkpoint_file', type=click.Path(dir_okay=False),
+              help='where to save the progress (FILE.checkpoint by default)')
+@click.option('--restart', is_flag=True,
+              help='start from the beginning, instead of resuming an interrupted backfill')
+def backfill(paths, namespace, workers, input_format, checkpoint_file, restart):
+    state = backfill_events.backfill(
+        list(paths), namespace, workers, input_format, checkpoint_file, restart,
+        lambda state: logger.info('{} events tracked ({:.0f}/s), {} lines skipped'.format(
+            state['events'], state['events_per_sec'], state['skipped'])))
+    logger.info('backfilled {} events in {:.1f}s, {} lines skipped'.format(
+        state['events'], state['seconds'], state['skipped']))
+
+
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,48 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class RecentlySeen(object):
+    """ a bounded LRU of recently tracked keys. a key is remembered for `ttl`
+        seconds after it was added (seeing it again doesn't extend that), and
+        the least recently seen keys are evicted beyond `capacity` keys
+    """
+
+    def __init__(self, capacity=100000, ttl=300):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def seen(self, key):
+        """ whether the key was added in the last `ttl` seconds """
+        with self.lock:
+            expires = self.entries.pop(key, None)
+            if expires is None or expires <= time.time():
+                self.misses += 1
+                return False
+            # the key moves to the most recently seen end
+            self.entries[key] = expires
+            self.hits += 1
+            return True
+
+    def add(self, keys):
+        expires = time.time() + self.ttl
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+                self.entries[key] = expires
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'capacity': self.capacity, 'ttl': self.ttl, 'size': len(self.entries),
+                    'hits': self.hits, 'misses': self.misses}
@@ -1,24 +1,38 @@
 from __future__ import print_function
 from botocore.client import ClientError
 import os
-import redis
+import sys
+import threading
+import time
 from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
 try:
     from gimel import logger
-    from gimel.gimel import _redis
+    from gimel.gimel import _redis_clients
     from gimel.config import config
-    from gimel.aws_api import iam, apigateway, aws_lambda, region, check_aws_credentials
+    from gimel.aws_api import (iam, apigateway, aws_lambda, first, region,
+                               check_aws_credentials)
 except ImportError:
     import logger
-    from gimel import _redis
+    from gimel import _redis_clients
     from config import config
-    from aws_api import iam, apigateway, aws_lambda, region, check_aws_credentials
+    from aws_api import (iam, apigateway, aws_lambda, first, region,
+                         check_aws_credentials)
+# imported after gimel, which puts the vendored redis first on sys.path
+import redis
 
 
 logger = logger.setup()
+_resources_lock = threading.Lock()
 LIVE = 'live'
+RUNTIME = 'python3.8'
+DEPLOY_WORKERS = 8
+LAMBDA_MODULES = ('config.py', 'dedupe.py', 'gimel.py', 'hll.py', 'ingest.py', 'logger.py',
+                  'metrics.py', 'optional.py', 'stats.py')
+# fixed timestamp for zip entries, so unchanged code produces the same zip
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
 REVISIONS = 5
 TRACK_ENDPOINT = 'track'
+TRACK_BATCH_ENDPOINT = 'track_batch'
 EXPERIMENTS_ENDPOINT = 'experiments'
 POLICY = """{
     "Version": "2012-10-17",
@@ -77,6 +91,13 @@ REQUEST_TEMPLATE = {'application/json':
         #end
        }
     """}
+# passes the JSON array of events in the request body to the handler
+BATCH_REQUEST_TEMPLATE = {'application/json':
+    """{
+        "namespace" : "$util.escapeJavaScript($input.params('namespace'))",
+        "events" : $input.json('$')
+       }
+    """}
 
 WIRING = [
     {
@@ -101,6 +122,25 @@ WIRING = [
             }
         }
     },
+    {
+        "lambda": {
+            "FunctionName": "gimel-track-batch",
+            "Handler": "gimel.track_batch",
+            "MemorySize": 128,
+            "Timeout": 10
+        },
+        "api_gateway": {
+            "pathPart": TRACK_BATCH_ENDPOINT,
+            "requestTemplates": BATCH_REQUEST_TEMPLATE,
+            "method": {
+                "httpMethod": "POST",
+                "apiKeyRequired": False,
+                "requestParameters": {
+                    "method.request.querystring.namespace": False
+                }
+            }
+        }
+    },
     {
         "lambda": {
             "FunctionName": "gimel-all-experiments",
@@ -115,7 +155,14 @@ WIRING = [
                 "apiKeyRequired": True,
                 "requestParameters": {
                     "method.request.querystring.namespace": False,
-                    "method.request.querystring.scope": False
+                    "method.request.querystring.scope": False,
+                    "method.request.querystring.limit": False,
+                    "method.request.querystring.cursor": False,
+                    "method.request.querystring.fresh": False,
+                    "method.request.querystring.from": False,
+                    "method.request.querystring.to": False,
+                    "method.request.querystring.stats": False,
+                    "method.request.querystring.control": False
                 }
             }
         }
@@ -135,6 +182,7 @@ WIRING = [
                 "requestParameters": {
                     "method.request.querystring.namespace": False,
                     "method.request.querystring.experiment": False,
+                    "method.request.querystring.async": False,
                 }
             }
         }
@@ -142,23 +190,109 @@ WIRING = [
 ]
 
 
-def prepare_zip():
+def _lambda_files():
+    """ yields (filename, name in zip) for the files of the lambda package """
     from pkg_resources import resource_filename as resource
+    for module in LAMBDA_MODULES:
+        yield resource('gimel', module), module
+    for root, dirs, files in os.walk(resource('gimel', 'vendor')):
+        dirs[:] = [d for d in dirs if d != '__pycache__']
+        for file in files:
+            if file.endswith('.pyc'):
+                continue
+            real_file = os.path.join(root, file)
+            relative_file = os.path.relpath(real_file,
+                                            resource('gimel', ''))
+            yield real_file, relative_file
+
+
+def _compile(filename, arcname):
+    """ returns the (name in zip, bytecode) of the .pyc for `filename`.
+        The .pyc doesn't check the source timestamp, which is meaningless
+        inside the zip
+    """
+    import py_compile
+    import tempfile
+    from importlib.util import cache_from_source
+    fd, cfile = tempfile.mkstemp(suffix='.pyc')
+    os.close(fd)
+    try:
+        py_compile.compile(
+            filename, cfile=cfile, dfile=arcname, doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+        with open(cfile, 'rb') as compiled:
+            return cache_from_source(arcname), compiled.read()
+    finally:
+        os.remove(cfile)
+
+
+def prepare_zip(precompile=False):
+    """ creates gimel.zip. The zip is deterministic (sorted entries, fixed
+        timestamps and permissions), so unchanged code has the same hash.
+        With `precompile`, .pyc files are added, so the lambda doesn't have
+        to compile every module on cold start. Those are only used when
+        compiled with the same python version as the runtime
+    """
     from json import dumps
+    if precompile and sys.version_info < (3, 7):
+        # unchecked hash based .pyc files (PEP 552) were added in python 3.7
+        raise RuntimeError('precompiling requires python 3.7 or above')
     logger.info('creating/updating gimel.zip')
+    if precompile and 'python{}.{}'.format(*sys.version_info[:2]) != RUNTIME:
+        logger.warning('precompiling with python {}.{}, but the lambda runtime '
+                       'is {}. .pyc files will be ignored'.format(
+                           sys.version_info[0], sys.version_info[1], RUNTIME))
     with ZipFile('gimel.zip', 'w', ZIP_DEFLATED) as zipf:
-        info = ZipInfo('config.json')
-        info.external_attr = 0o664 << 16
-        zipf.writestr(info, dumps(config))
-        zipf.write(resource('gimel', 'config.py'), 'config.py')
-        zipf.write(resource('gimel', 'gimel.py'), 'gimel.py')
-        zipf.write(resource('gimel', 'logger.py'), 'logger.py')
-        for root, dirs, files in os.walk(resource('gimel', 'vendor')):
-            for file in files:
-                real_file = os.path.join(root, file)
-                relative_file = os.path.relpath(real_file,
-                                                resource('gimel', ''))
-                zipf.write(real_file, relative_file)
+        _zip_entry(zipf, 'config.json', dumps(config, sort_keys=True), 0o664)
+        for filename, arcname in sorted(_lambda_files(), key=lambda f: f[1]):
+            with open(filename, 'rb') as source:
+                _zip_entry(zipf, arcname, source.read())
+            if precompile and arcname.endswith('.py'):
+                _zip_entry(zipf, *_compile(filename, arcname))
+
+
+def _zip_entry(zipf, arcname, data, mode=0o644):
+    info = ZipInfo(arcname, date_time=ZIP_DATE_TIME)
+    info.external_attr = mode << 16
+    info.compress_type = ZIP_DEFLATED
+    zipf.writestr(info, data)
+
+
+def _zip_sha256(zip_filename='gimel.zip'):
+    """ returns the zip contents and their base64 encoded SHA-256, as
+        reported by lambda as the CodeSha256 of a function
+    """
+    from base64 import b64encode
+    from hashlib import sha256
+    with open(zip_filename, 'rb') as zf:
+        code = zf.read()
+    return code, b64encode(sha256(code).digest()).decode('utf-8')
+
+
+def import_time_report(zip_filename='gimel.zip'):
+    """ imports the lambda handler module from the extracted zip with
+        `-X importtime` and returns (self us, cumulative us, module) for each
+        imported module, slowest first
+    """
+    import shutil
+    import subprocess
+    import tempfile
+    extracted = tempfile.mkdtemp()
+    try:
+        with ZipFile(zip_filename) as zipf:
+            zipf.extractall(extracted)
+        output = subprocess.check_output(
+            [sys.executable, '-X', 'importtime', '-c', 'import gimel'],
+            cwd=extracted, stderr=subprocess.STDOUT).decode('utf-8')
+    finally:
+        shutil.rmtree(extracted)
+    report = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, module = line.split(':', 1)[1].split('|')
+        report.append((int(self_us), int(cumulative_us), module.rstrip()))
+    return sorted(report, key=lambda row: row[1], reverse=True)
 
 
 def role():
@@ -200,18 +334,20 @@ def _cleanup_old_versions(name):
 
 
 def _function_alias(name, version, alias=LIVE):
+    # creating an existing alias fails with ResourceConflictException, which
+    # is retried (see aws_api.RETRYABLE_ERRORS), so the alias is updated first
     try:
-        logger.info('creating function alias {0} for {1}:{2}'.format(
+        logger.info('updating function alias {0} -> {1}:{2}'.format(
             alias, name, version))
-        arn = aws_lambda('create_alias',
+        arn = aws_lambda('update_alias',
                          FunctionName=name,
                          FunctionVersion=version,
                          Name=alias,
                          query='AliasArn')
     except ClientError:
-        logger.info('alias {0} exists. updating {0} -> {1}:{2}'.format(
+        logger.info('alias {0} not found. creating {0} for {1}:{2}'.format(
             alias, name, version))
-        arn = aws_lambda('update_alias',
+        arn = aws_lambda('create_alias',
                          FunctionName=name,
                          FunctionVersion=version,
                          Name=alias,
@@ -248,13 +384,13 @@ def rollback_lambda(name, alias=LIVE):
 
 
 def rollback(alias=LIVE):
-    for lambda_function in ('gimel-track', 'gimel-all-experiments'):
+    for lambda_function in ('gimel-track', 'gimel-track-batch', 'gimel-all-experiments'):
         rollback_lambda(lambda_function, alias)
 
 
 def get_create_api():
-    api_id = apigateway('get_rest_apis',
-                        query='items[?name==`gimel`] | [0].id')
+    api_id = first('apigateway', 'get_rest_apis',
+                   query='items[?name==`gimel`] | [0].id')
     if not api_id:
         api_id = apigateway('create_rest_api', name='gimel',
                             description='Gimel API', query='id')
@@ -263,8 +399,8 @@ def get_create_api():
 
 
 def get_api_key():
-    return apigateway('get_api_keys',
-                      query='items[?name==`gimel`] | [0].id')
+    return first('apigateway', 'get_api_keys',
+                 query='items[?name==`gimel`] | [0].id')
 
 
 def api_key(api_id):
@@ -280,15 +416,21 @@ def api_key(api_id):
 
 
 def resource(api_id, path):
-    resource_id = apigateway('get_resources', restApiId=api_id,
-                             query='items[?path==`/{}`].id | [0]'.format(path))
+    resource_id = first('apigateway', 'get_resources', restApiId=api_id,
+                        query='items[?path==`/{}`].id | [0]'.format(path))
     if resource_id:
         return resource_id
-    root_resource_id = apigateway('get_resources', restApiId=api_id,
-                                  query='items[?path==`/`].id | [0]')
-    resource_id = apigateway('create_resource', restApiId=api_id,
-                             parentId=root_resource_id,
-                             pathPart=path, query='id')
+    # resources under the same parent can't be created concurrently
+    with _resources_lock:
+        resource_id = first('apigateway', 'get_resources', restApiId=api_id,
+                            query='items[?path==`/{}`].id | [0]'.format(path))
+        if resource_id:
+            return resource_id
+        root_resource_id = first('apigateway', 'get_resources', restApiId=api_id,
+                                 query='items[?path==`/`].id | [0]')
+        resource_id = apigateway('create_resource', restApiId=api_id,
+                                 parentId=root_resource_id,
+                                 pathPart=path, query='id')
     return resource_id
 
 
@@ -299,40 +441,93 @@ def function_uri(function_arn, region):
     return uri
 
 
-def _clear_method(api_id, resource_id, http_method):
+def _method_definition(method, integration, method_response,
+                       integration_response):
+    """ the parts of an API method gimel manages, normalized so the desired
+        method can be compared with the result of get_method
+    """
+    def templates(value):
+        return dict((k, v or '') for k, v in (value or {}).items())
+    # the http method of MOCK integrations isn't stored
+    mock = integration.get('type') == 'MOCK'
+    return {
+        'method': (method.get('authorizationType'),
+                   bool(method.get('apiKeyRequired')),
+                   method.get('requestParameters') or {}),
+        'integration': (integration.get('type'),
+                        None if mock else integration.get('httpMethod'),
+                        integration.get('uri'),
+                        integration.get('credentials'),
+                        templates(integration.get('requestTemplates'))),
+        'method_response': (method_response.get('responseParameters') or {},
+                            method_response.get('responseModels') or {}),
+        'integration_response': (
+            integration_response.get('responseParameters') or {},
+            templates(integration_response.get('responseTemplates')))
+    }
+
+
+def _put_method(api_id, resource_id, method, integration, method_response,
+                integration_response):
+    """ creates the API method with its integration and 200 responses.
+        An existing method is left alone if it already matches, and only
+        replaced when it differs. returns whether anything changed
+    """
+    http_method = method['httpMethod']
     try:
-        method = apigateway('get_method', restApiId=api_id,
-                            resourceId=resource_id,
-                            httpMethod=http_method)
+        current = apigateway('get_method', restApiId=api_id,
+                             resourceId=resource_id,
+                             httpMethod=http_method)
     except ClientError:
-        method = None
-    if method:
+        current = None
+    if current:
+        current_integration = current.get('methodIntegration', {})
+        current_definition = _method_definition(
+            current, current_integration,
+            current.get('methodResponses', {}).get('200', {}),
+            current_integration.get('integrationResponses', {}).get('200', {}))
+        definition = _method_definition(
+            method,
+            dict(integration, httpMethod=integration['integrationHttpMethod']),
+            method_response, integration_response)
+        if current_definition == definition:
+            logger.debug('{} method is up to date'.format(http_method))
+            return False
         apigateway('delete_method', restApiId=api_id, resourceId=resource_id,
                    httpMethod=http_method)
-
-
-def cors(api_id, resource_id):
-    _clear_method(api_id, resource_id, 'OPTIONS')
     apigateway('put_method', restApiId=api_id, resourceId=resource_id,
-               httpMethod='OPTIONS', authorizationType='NONE',
-               apiKeyRequired=False)
+               **method)
     apigateway('put_integration', restApiId=api_id, resourceId=resource_id,
-               httpMethod='OPTIONS', type='MOCK', integrationHttpMethod='POST',
-               requestTemplates={'application/json': '{"statusCode": 200}'})
+               httpMethod=http_method, **integration)
     apigateway('put_method_response', restApiId=api_id, resourceId=resource_id,
-               httpMethod='OPTIONS', statusCode='200',
-               responseParameters={
-                   "method.response.header.Access-Control-Allow-Origin": False,
-                   "method.response.header.Access-Control-Allow-Methods": False,
-                   "method.response.header.Access-Control-Allow-Headers": False},
-               responseModels={'application/json': 'Empty'})
+               httpMethod=http_method, statusCode='200', **method_response)
     apigateway('put_integration_response', restApiId=api_id,
-               resourceId=resource_id, httpMethod='OPTIONS', statusCode='200',
-               responseParameters={
-                   "method.response.header.Access-Control-Allow-Origin": "'*'",
-                   "method.response.header.Access-Control-Allow-Methods": "'GET,OPTIONS'",
-                   "method.response.header.Access-Control-Allow-Headers": "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'"},  # noqa
-               responseTemplates={'application/json': ''})
+               resourceId=resource_id, httpMethod=http_method, statusCode='200',
+               **integration_response)
+    return True
+
+
+def cors(api_id, resource_id, http_method='GET'):
+    return _put_method(
+        api_id, resource_id,
+        method=dict(httpMethod='OPTIONS', authorizationType='NONE',
+                    apiKeyRequired=False),
+        integration=dict(
+            type='MOCK', integrationHttpMethod='POST',
+            requestTemplates={'application/json': '{"statusCode": 200}'}),
+        method_response=dict(
+            responseParameters={
+                "method.response.header.Access-Control-Allow-Origin": False,
+                "method.response.header.Access-Control-Allow-Methods": False,
+                "method.response.header.Access-Control-Allow-Headers": False},
+            responseModels={'application/json': 'Empty'}),
+        integration_response=dict(
+            responseParameters={
+                "method.response.header.Access-Control-Allow-Origin": "'*'",
+                "method.response.header.Access-Control-Allow-Methods":
+                    "'{},OPTIONS'".format(http_method),
+                "method.response.header.Access-Control-Allow-Headers": "'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'"},  # noqa
+            responseTemplates={'application/json': ''}))
 
 
 def deploy_api(api_id):
@@ -346,71 +541,94 @@ def deploy_api(api_id):
 
 
 def api_method(api_id, resource_id, role_arn, function_uri, wiring):
-    http_method = wiring['method']['httpMethod']
-    _clear_method(api_id, resource_id, http_method)
-    apigateway('put_method', restApiId=api_id, resourceId=resource_id,
-               authorizationType='NONE',
-               **wiring['method'])
-    apigateway('put_integration', restApiId=api_id, resourceId=resource_id,
-               httpMethod=http_method, type='AWS', integrationHttpMethod='POST',
-               credentials=role_arn,
-               uri=function_uri,
-               requestTemplates=REQUEST_TEMPLATE)
-    apigateway('put_method_response', restApiId=api_id, resourceId=resource_id,
-               httpMethod=http_method, statusCode='200',
-               responseParameters={
-                   "method.response.header.Access-Control-Allow-Origin": False,
-                   "method.response.header.Pragma": False,
-                   "method.response.header.Cache-Control": False},
-               responseModels={'application/json': 'Empty'})
-    apigateway('put_integration_response', restApiId=api_id,
-               resourceId=resource_id, httpMethod=http_method, statusCode='200',
-               responseParameters={
-                   "method.response.header.Access-Control-Allow-Origin": "'*'",
-                   "method.response.header.Pragma": "'no-cache'",
-                   "method.response.header.Cache-Control": "'no-cache, no-store, must-revalidate'"},
-               responseTemplates={'application/json': ''})
+    return _put_method(
+        api_id, resource_id,
+        method=dict(authorizationType='NONE', **wiring['method']),
+        integration=dict(
+            type='AWS', integrationHttpMethod='POST',
+            credentials=role_arn,
+            uri=function_uri,
+            requestTemplates=wiring.get('requestTemplates', REQUEST_TEMPLATE)),
+        method_response=dict(
+            responseParameters={
+                "method.response.header.Access-Control-Allow-Origin": False,
+                "method.response.header.Pragma": False,
+                "method.response.header.Cache-Control": False},
+            responseModels={'application/json': 'Empty'}),
+        integration_response=dict(
+            responseParameters={
+                "method.response.header.Access-Control-Allow-Origin": "'*'",
+                "method.response.header.Pragma": "'no-cache'",
+                "method.response.header.Cache-Control": "'no-cache, no-store, must-revalidate'"},
+            responseTemplates={'application/json': ''}))
 
 
 def create_update_lambda(role_arn, wiring):
+    """ creates or updates the lambda function and points its alias to the
+        latest version. Code is only uploaded (and a version published) when
+        its SHA-256 differs from the deployed code, or the configuration
+        changed. Otherwise, the alias is moved back to the latest version
+        if it points elsewhere, e.g. after a rollback
+    """
     name, handler, memory, timeout = (wiring[k] for k in ('FunctionName',
                                                           'Handler',
                                                           'MemorySize',
                                                           'Timeout'))
+    function_config = dict(Runtime=RUNTIME, Role=role_arn, Handler=handler,
+                           MemorySize=memory, Timeout=timeout)
+    code, code_sha256 = _zip_sha256()
     try:
         logger.info('finding lambda function')
-        function_arn = aws_lambda('get_function',
-                                  FunctionName=name,
-                                  query='Configuration.FunctionArn')
+        configuration = aws_lambda('get_function',
+                                   FunctionName=name,
+                                   query='Configuration')
     except ClientError:
-        function_arn = None
-    if not function_arn:
+        configuration = None
+    if not configuration:
         logger.info('creating new lambda function {}'.format(name))
-        with open('gimel.zip', 'rb') as zf:
-            function_arn, version = aws_lambda('create_function',
-                                               FunctionName=name,
-                                               Runtime='python3.8',
-                                               Role=role_arn,
-                                               Handler=handler,
-                                               MemorySize=memory,
-                                               Timeout=timeout,
-                                               Publish=True,
-                                               Code={'ZipFile': zf.read()},
-                                               query='[FunctionArn, Version]')
+        function_arn, version = aws_lambda('create_function',
+                                           FunctionName=name,
+                                           Publish=True,
+                                           Code={'ZipFile': code},
+                                           query='[FunctionArn, Version]',
+                                           **function_config)
     else:
-        logger.info('updating lambda function {}'.format(name))
-        aws_lambda('update_function_configuration',
-                   FunctionName=name,
-                   Runtime='python3.8',
-                   Role=role_arn,
-                   Handler=handler,
-                   MemorySize=memory,
-                   Timeout=timeout)
-        with open('gimel.zip', 'rb') as zf:
+        config_changed = any(configuration.get(k) != v
+                             for k, v in function_config.items())
+        code_changed = configuration.get('CodeSha256') != code_sha256
+        if not config_changed and not code_changed:
+            try:
+                alias_arn, live_version = aws_lambda(
+                    'get_alias', FunctionName=name, Name=LIVE,
+                    query='[AliasArn, FunctionVersion]')
+            except ClientError:
+                live_version = None
+            versions = live_version and _versions(name)
+            if versions:
+                # the alias may still point to an older version after a rollback
+                latest_version = max(versions, key=int)
+                if live_version == latest_version:
+                    logger.info('lambda function {} is up to date'.format(name))
+                    return alias_arn
+                logger.info('lambda function {} is up to date, but {} points to '
+                            'version {}'.format(name, LIVE, live_version))
+                return _function_alias(name, latest_version)
+        if config_changed:
+            logger.info('updating lambda function {} configuration'.format(name))
+            aws_lambda('update_function_configuration',
+                       FunctionName=name,
+                       **function_config)
+        if code_changed:
+            logger.info('updating lambda function {} code'.format(name))
             function_arn, version = aws_lambda('update_function_code',
                                                FunctionName=name,
                                                Publish=True,
-                                               ZipFile=zf.read(),
+                                               ZipFile=code,
+                                               query='[FunctionArn, Version]')
+        else:
+            function_arn, version = aws_lambda('publish_version',
+                                               FunctionName=name,
+                                               CodeSha256=code_sha256,
                                                query='[FunctionArn, Version]')
     function_arn = _function_alias(name, version)
     _cleanup_old_versions(name)
@@ -418,13 +636,14 @@ def create_update_lambda(role_arn, wiring):
     return function_arn
 
 
-def create_update_api(role_arn, function_arn, wiring):
+def create_update_api(role_arn, function_arn, wiring, api_id=None):
     logger.info('creating or updating api /{}'.format(wiring['pathPart']))
-    api_id = get_create_api()
+    api_id = api_id or get_create_api()
     resource_id = resource(api_id, wiring['pathPart'])
     uri = function_uri(function_arn, region())
-    api_method(api_id, resource_id, role_arn, uri, wiring)
-    cors(api_id, resource_id)
+    method_changed = api_method(api_id, resource_id, role_arn, uri, wiring)
+    cors_changed = cors(api_id, resource_id, wiring['method']['httpMethod'])
+    return method_changed or cors_changed
 
 
 def js_code_snippet():
@@ -492,22 +711,57 @@ def preflight_checks():
         return False
     logger.info('testing redis')
     try:
-        _redis().ping()
+        for r in _redis_clients():
+            r.ping()
     except redis.exceptions.ConnectionError:
         logger.error('Redis ping failed. Please run gimel configure')
         return False
     return True
 
 
-def run():
-    prepare_zip()
-    api_id = get_create_api()
-    role_arn = role()
-    for component in WIRING + config.get("extra_wiring", []):
-        function_arn = create_update_lambda(role_arn, component['lambda'])
-        create_update_api(role_arn, function_arn, component['api_gateway'])
-    deploy_api(api_id)
-    api_key(api_id)
+def _timed(timings, step, func, *args):
+    start = time.time()
+    try:
+        return func(*args)
+    finally:
+        timings.append((step, time.time() - start))
+
+
+def run(precompile=False, workers=DEPLOY_WORKERS):
+    """ deploys all lambda functions in parallel, and then all their API
+        methods in parallel. Each function is deployed once, even if it's
+        used by several endpoints
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    timings = []
+    start = time.time()
+    _timed(timings, 'zip', prepare_zip, precompile)
+    api_id = _timed(timings, 'api', get_create_api)
+    role_arn = _timed(timings, 'role', role)
+    components = WIRING + config.get("extra_wiring", [])
+    functions = dict((component['lambda']['FunctionName'], component['lambda'])
+                     for component in components)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        function_arns = dict(zip(functions, executor.map(
+            lambda wiring: _timed(timings, 'lambda {}'.format(wiring['FunctionName']),
+                                  create_update_lambda, role_arn, wiring),
+            functions.values())))
+        api_changes = list(executor.map(
+            lambda component: _timed(
+                timings, 'api /{}'.format(component['api_gateway']['pathPart']),
+                create_update_api, role_arn,
+                function_arns[component['lambda']['FunctionName']],
+                component['api_gateway'], api_id),
+            components))
+    if any(api_changes):
+        _timed(timings, 'deploy api', deploy_api, api_id)
+    else:
+        logger.info('API is up to date')
+    _timed(timings, 'api key', api_key, api_id)
+
+    logger.info('deployed in {:.1f}s'.format(time.time() - start))
+    for step, seconds in timings:
+        logger.info('{:>8.1f}s {}'.format(seconds, step))
 
 
 if __name__ == '__main__':
@@ -1,18 +1,422 @@
 from __future__ import print_function
+import bisect
+import hashlib
+import json
+import os
+import re
+import socket
 import sys
-sys.path.insert(0, './vendor')
+import threading
+import time
+_import_started = time.time()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vendor'))
 import redis
+import redis.sentinel
+from redis._compat import nativestr
 try:
+    from gimel import dedupe
+    from gimel import hll
+    from gimel import ingest
+    from gimel import metrics
+    from gimel import stats
     from gimel.config import config
 except ImportError:
+    import dedupe
+    import hll
+    import ingest
+    import metrics
+    import stats
     from config import config
 
+metrics.configure(config.get('metrics'))
 
-def _redis():
-    redis_config = config['redis']
-    redis_config["charset"] = "utf-8"
-    redis_config["decode_responses"] = True
-    return redis.Redis(**redis_config)
+# defaults for the redis connection pool. Any of those (as well as
+# `max_connections`, `socket_timeout` and `socket_connect_timeout`) can be
+# overridden in the `redis` section of config.json
+REDIS_DEFAULTS = {
+    'socket_keepalive': True,
+    'retry_on_timeout': True,
+    'health_check_interval': 30
+}
+TCP_ONLY_OPTIONS = ('host', 'port', 'socket_connect_timeout',
+                    'socket_keepalive', 'socket_keepalive_options')
+# maximum number of commands sent in a single pipeline by bulk reads
+BULK_CHUNK_SIZE = 1000
+# maximum number of keys deleted at once. deleting many HyperLogLogs (up to
+# 12kb each) in one command blocks redis
+DELETE_CHUNK_SIZE = 500
+# seconds a single caller gets to recalculate stale cached results
+RESULTS_CACHE_LOCK_TIMEOUT = 60
+# time buckets (see `buckets` in config.json)
+BUCKET_FORMATS = {'hour': '%Y%m%d%H', 'day': '%Y%m%d'}
+BUCKET_SECONDS = {'hour': 3600, 'day': 86400}
+BUCKET_TTL = 90 * 86400
+TIME_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H', '%Y-%m-%dT%H:%M',
+                '%Y-%m-%dT%H:%M:%S')
+# events queued per drain batch (see `ingest` in config.json)
+INGEST_BATCH_SIZE = 1000
+EVENT_FIELDS = ('experiment', 'variant', 'event', 'uuid')
+# points per node on the consistent hash ring (see `redis_shards` in config.json)
+SHARD_POINTS = 160
+# seconds between attempts to find the master while sentinel fails over
+# (see `sentinel` in config.json)
+FAILOVER_RETRY_INTERVAL = 0.25
+SENTINEL_DEFAULTS = {'socket_timeout': 1, 'socket_connect_timeout': 1}
+# defaults of the `dedupe` section: (counter key, uuid) pairs kept per
+# container, and for how many seconds
+DEDUPE_CAPACITY = 50000
+DEDUPE_TTL = 300
+
+_clients = None
+_readers = {}
+_raw_readers = {}
+_ring = None
+# reentrant, since clients are created while holding it, e.g. by _ingest_queue()
+_client_lock = threading.RLock()
+_unlink = None
+_queue = None
+_rate_limiters = {}
+_recent = None
+
+
+class _ConnectionPool(redis.ConnectionPool):
+    """ a connection pool that lives across warm lambda invocations.
+        connections that were idle for longer than `health_check_interval`
+        seconds are pinged before being handed out, and reconnected if the
+        ping fails (e.g. after the container was frozen for a while)
+    """
+
+    def __init__(self, health_check_interval=None, **kwargs):
+        self.health_check_interval = health_check_interval
+        super(_ConnectionPool, self).__init__(**kwargs)
+
+    def get_connection(self, command_name, *keys, **options):
+        connection = super(_ConnectionPool, self).get_connection(
+            command_name, *keys, **options)
+        if metrics.enabled() and connection._sock is None:
+            # connect now (instead of on the first command) to time it
+            try:
+                with metrics.timer('redis.connect'):
+                    connection.connect()
+            except redis.ConnectionError:
+                # the command fails to connect again, and releases the connection
+                pass
+        idle = time.time() - getattr(connection, 'last_used', time.time())
+        if self.health_check_interval is not None and idle > self.health_check_interval:
+            try:
+                connection.send_command('PING')
+                # raw pools (decode_responses=False) return b'PONG'
+                if nativestr(connection.read_response()) != 'PONG':
+                    raise redis.ConnectionError('Bad response to PING')
+            except (redis.ConnectionError, redis.TimeoutError):
+                # the next command on this connection reconnects
+                connection.disconnect()
+        return connection
+
+    def release(self, connection):
+        connection.last_used = time.time()
+        super(_ConnectionPool, self).release(connection)
+
+
+class _SentinelConnection(redis.sentinel.SentinelManagedConnection):
+    """ a connection to the master (or a replica) that sentinel currently
+        reports. while a failover is in progress connecting fails, so it
+        keeps asking sentinel again for up to `failover_timeout` seconds
+    """
+
+    def connect(self):
+        deadline = time.time() + self.connection_pool.failover_timeout
+        while True:
+            try:
+                return super(_SentinelConnection, self).connect()
+            except redis.ConnectionError:
+                if time.time() >= deadline:
+                    raise
+                metrics.count('redis.failover_retries')
+                time.sleep(FAILOVER_RETRY_INTERVAL)
+
+
+class _SentinelConnectionPool(_ConnectionPool, redis.sentinel.SentinelConnectionPool):
+    """ a _ConnectionPool of connections to the master (or the replicas) of
+        a sentinel service. all connections are dropped once sentinel
+        reports a new master
+    """
+
+    def __init__(self, service_name, sentinel_manager, failover_timeout=None, **kwargs):
+        self.failover_timeout = failover_timeout or 0
+        kwargs['connection_class'] = _SentinelConnection
+        super(_SentinelConnectionPool, self).__init__(
+            service_name=service_name, sentinel_manager=sentinel_manager, **kwargs)
+
+    def _checkpid(self):
+        # after a fork, the vendored _checkpid() calls __init__() again
+        # without the settings of this class, so they are kept here
+        settings = self.failover_timeout, self.health_check_interval
+        super(_SentinelConnectionPool, self)._checkpid()
+        self.failover_timeout, self.health_check_interval = settings
+
+
+def _pool_kwargs(redis_config, decode_responses=True):
+    kwargs = dict(REDIS_DEFAULTS)
+    kwargs.update(redis_config)
+    kwargs.pop('charset', None)
+    kwargs.update(encoding='utf-8', decode_responses=decode_responses)
+    keepalive_options = kwargs.get('socket_keepalive_options')
+    if keepalive_options:
+        # allow e.g. {"TCP_KEEPIDLE": 60} in config.json
+        kwargs['socket_keepalive_options'] = dict(
+            (getattr(socket, k) if not isinstance(k, int) else k, v)
+            for k, v in keepalive_options.items())
+    if kwargs.pop('ssl', False):
+        kwargs['connection_class'] = redis.SSLConnection
+    if 'unix_socket_path' in kwargs:
+        kwargs['path'] = kwargs.pop('unix_socket_path')
+        kwargs['connection_class'] = redis.UnixDomainSocketConnection
+        for option in TCP_ONLY_OPTIONS:
+            kwargs.pop(option, None)
+    return kwargs
+
+
+def _sentinel_pools(redis_config, decode_responses=True):
+    """ returns the (master, replica) connection pools of a node managed by
+        redis sentinel, or (master, None) without `read_from_replicas`.
+        `sentinels` is a list of [host, port] and the other options of the
+        `sentinel` section are used to connect to the sentinels
+    """
+    redis_config = dict(redis_config)
+    sentinel_config = dict(SENTINEL_DEFAULTS)
+    sentinel_config.update(redis_config.pop('sentinel'))
+    for option in ('host', 'port', 'unix_socket_path'):
+        redis_config.pop(option, None)
+    if redis_config.get('ssl'):
+        raise ValueError('ssl is not supported with sentinel')
+    kwargs = _pool_kwargs(redis_config, decode_responses)
+    kwargs.update(failover_timeout=sentinel_config.pop('failover_timeout', 0),
+                  check_connection=True)
+    sentinels = [tuple(address) for address in sentinel_config.pop('sentinels')]
+    service_name = sentinel_config.pop('service_name')
+    read_from_replicas = sentinel_config.pop('read_from_replicas', False)
+    min_other_sentinels = sentinel_config.pop('min_other_sentinels', 0)
+    manager = redis.sentinel.Sentinel(sentinels, min_other_sentinels=min_other_sentinels,
+                                      sentinel_kwargs=sentinel_config)
+    master = _SentinelConnectionPool(service_name, manager, is_master=True, **kwargs)
+    if not read_from_replicas:
+        return master, None
+    return master, _SentinelConnectionPool(service_name, manager, is_master=False, **kwargs)
+
+
+def _node_clients(redis_config, decode_responses=True):
+    """ returns the (client, read client) of a node. the read client is a
+        client of the replicas with sentinel and `read_from_replicas`, and
+        the same client otherwise
+    """
+    if not redis_config.get('sentinel'):
+        pool = _ConnectionPool(**_pool_kwargs(redis_config, decode_responses))
+        client = redis.Redis(connection_pool=pool)
+        return client, client
+    master, replicas = _sentinel_pools(redis_config, decode_responses)
+    client = redis.Redis(connection_pool=master)
+    if replicas is None:
+        return client, client
+    return client, redis.Redis(connection_pool=replicas)
+
+
+def _node_name(redis_config):
+    if redis_config.get('sentinel'):
+        default_name = 'sentinel:{0}/{1}'.format(redis_config['sentinel']['service_name'],
+                                                 redis_config.get('db', 0))
+        return redis_config.get('name') or default_name
+    default_name = '{0}:{1}/{2}'.format(redis_config.get('host', 'localhost'),
+                                        redis_config.get('port', 6379),
+                                        redis_config.get('db', 0))
+    return redis_config.get('name') or redis_config.get('unix_socket_path') or default_name
+
+
+def _hash(value):
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _hash_ring(nodes):
+    """ returns the sorted (point, node index) ring. every node gets
+        SHARD_POINTS points derived from its name, so adding or removing a
+        node only moves the experiments next to its points
+    """
+    return sorted((_hash('{0}#{1}'.format(_node_name(node), point)), index)
+                  for index, node in enumerate(nodes)
+                  for point in range(SHARD_POINTS))
+
+
+def _redis_clients():
+    """ returns a redis client per node, each sharing one connection pool
+        across calls (and warm lambda invocations). the nodes are either
+        `redis_shards` or just `redis` from config.json
+    """
+    global _clients, _ring, _readers, _raw_readers
+    if _clients is None:
+        with _client_lock:
+            if _clients is None:
+                nodes = config.get('redis_shards') or [config['redis']]
+                _ring = _hash_ring(nodes)
+                node_clients = [_node_clients(node) for node in nodes]
+                _readers = dict(node_clients)
+                # pools only connect on first use, i.e. with `local_counts`
+                _raw_readers = dict(
+                    (client, _node_clients(node, decode_responses=False)[1])
+                    for (client, _), node in zip(node_clients, nodes))
+                _clients = [client for client, _ in node_clients]
+    return _clients
+
+
+def _reader(r):
+    """ returns the client for reads from the node of client `r`, i.e. its
+        replicas (see `sentinel` in config.json) or else `r` itself
+    """
+    return _readers.get(r, r)
+
+
+def _raw_reader(r):
+    """ like _reader(), but the client returns raw bytes (for HyperLogLogs) """
+    return _raw_readers[r]
+
+
+def _redis(namespace=None, experiment=None):
+    """ returns the redis client of the node that stores the experiment.
+        all the keys of an experiment live on the same node
+    """
+    clients = _redis_clients()
+    if len(clients) == 1:
+        return clients[0]
+    if experiment is None:
+        raise ValueError('an experiment is required to pick a redis shard')
+    point = bisect.bisect(_ring, (_hash('{0}:{1}'.format(namespace, experiment)),))
+    return clients[_ring[point % len(_ring)][1]]
+
+
+def _by_shard(namespace, experiments):
+    """ returns {redis client: [experiments stored on it]} """
+    shards = {}
+    for ex in experiments:
+        shards.setdefault(_redis(namespace, ex), []).append(ex)
+    return shards
+
+
+def _fan_out(func, calls):
+    """ calls `func(*args)` for every args in `calls`, in parallel threads
+        when there's more than one, and returns the results in order
+    """
+    if len(calls) < 2:
+        return [func(*args) for args in calls]
+    results = [None] * len(calls)
+    errors = []
+
+    def run(i, args):
+        try:
+            results[i] = func(*args)
+        except Exception as error:
+            errors.append(error)
+    threads = [threading.Thread(target=run, args=(i, args)) for i, args in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def _script(name, source):
+    script = redis.client.Script(None, source)
+    script.name = name
+    script.sha = hashlib.sha1(source.encode('utf-8')).hexdigest()
+    return script
+
+
+# KEYS: counter key, {ns}:experiments, {ns}:{experiment}:counter_keys
+#       [, bucket key] [, {ns}:counter_keys]
+# ARGV: experiment, bucket ttl (0 without a bucket key), exact threshold,
+#       uuid [uuid ...]
+# the index sets are only updated when the counter key is new to the
+# counter set of its experiment. a counter key (or bucket) that exists but
+# isn't in that set is left over from a deleted experiment whose keys
+# aren't reclaimed yet, so it starts over.
+# counters are exact sets up to `exact threshold` uuids, and are then
+# promoted to a HyperLogLog. bucket keys are always HyperLogLogs
+TRACK_SCRIPT = _script('track', """
+local bucket = tonumber(ARGV[2]) > 0 and KEYS[4]
+local index = KEYS[bucket and 5 or 4]
+local threshold = tonumber(ARGV[3])
+local counter_type = redis.call('TYPE', KEYS[1]).ok
+if redis.call('SADD', KEYS[3], KEYS[1]) == 1 then
+    if counter_type ~= 'none' then
+        redis.call('DEL', KEYS[1])
+        counter_type = 'none'
+    end
+    if bucket then
+        redis.call('DEL', bucket)
+    end
+    redis.call('SADD', KEYS[2], ARGV[1])
+    if index then
+        redis.call('SADD', index, KEYS[1])
+    end
+end
+if bucket then
+    if redis.call('PFADD', bucket) == 1 then
+        redis.call('EXPIRE', bucket, ARGV[2])
+    end
+    redis.call('PFADD', bucket, unpack(ARGV, 4))
+end
+if counter_type == 'set' or (counter_type == 'none' and threshold > 0) then
+    local added = redis.call('SADD', KEYS[1], unpack(ARGV, 4))
+    if redis.call('SCARD', KEYS[1]) <= threshold then
+        return added
+    end
+    local uuids = redis.call('SMEMBERS', KEYS[1])
+    redis.call('DEL', KEYS[1])
+    for i = 1, #uuids, 1000 do
+        redis.call('PFADD', KEYS[1], unpack(uuids, i, math.min(i + 999, #uuids)))
+    end
+    return 1
+end
+return redis.call('PFADD', KEYS[1], unpack(ARGV, 4))
+""")
+# KEYS: {ns}:{experiment}:counter_keys, {ns}:counter_keys, tombstone,
+#       counter key [counter key ...]
+# ARGV: the command deleting keys (UNLINK or DEL)
+# deletes the counter keys of a deleted experiment, except those tracked
+# again since then (see TRACK_SCRIPT), and removes them all from the
+# tombstone. returns the number of keys deleted
+RECLAIM_SCRIPT = _script('reclaim', """
+local deleted = 0
+for i = 4, #KEYS do
+    if redis.call('SISMEMBER', KEYS[1], KEYS[i]) == 0 then
+        redis.call(ARGV[1], KEYS[i])
+        redis.call('SREM', KEYS[2], KEYS[i])
+        deleted = deleted + 1
+    end
+    redis.call('SREM', KEYS[3], KEYS[i])
+end
+return deleted
+""")
+# upper bound for the number of uuids passed to a single script call
+# (lua's unpack() is limited by the C stack size)
+SCRIPT_MAX_UUIDS = 1000
+
+
+def _execute_script(r, script, calls):
+    """ runs `script` for every (keys, args) in `calls` using EVALSHA in a
+        single pipeline. If the script isn't cached on the server yet, it is
+        loaded and the pipeline runs again, so scripts must be idempotent
+    """
+    try:
+        pipe = r.pipeline(transaction=False)
+        for keys, args in calls:
+            pipe.evalsha(script.sha, len(keys), *(tuple(keys) + tuple(args)))
+        metrics.size('redis.pipeline_size', len(calls), script=script.name)
+        with metrics.timer('redis.script', script=script.name):
+            return pipe.execute()
+    except redis.exceptions.NoScriptError:
+        script.sha = r.script_load(script.script)
+        return _execute_script(r, script, calls)
 
 
 def _counter_key(namespace, experiment, goal, variant):
@@ -23,21 +427,263 @@ def _counter_key(namespace, experiment, goal, variant):
         variant)
 
 
+def _bucket_key(counter_key, bucket):
+    namespace, counter = counter_key.split(':counters:', 1)
+    return '{0}:buckets:{1}:{2}'.format(namespace, counter, bucket)
+
+
+def _bucket(timestamp, resolution):
+    return time.strftime(BUCKET_FORMATS[resolution], time.gmtime(timestamp))
+
+
+def _parse_time(value):
+    """ parses a UTC date/time (e.g. 2018-01-31 or 2018-01-31T13:00) or unix
+        timestamp into a unix timestamp
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # calendar is slow to import and only needed for time windows
+    import calendar
+    for time_format in TIME_FORMATS:
+        try:
+            return calendar.timegm(time.strptime(value, time_format))
+        except ValueError:
+            pass
+    raise ValueError('Invalid time {}'.format(value))
+
+
+def _escape_pattern(value):
+    """ escapes glob-style characters for SCAN MATCH patterns """
+    return re.sub(r'([\\*?\[\]])', r'\\\1', value)
+
+
+def _window(event):
+    """ returns the (from, to) timestamps of the event, or None """
+    if not event.get('from'):
+        return None
+    if not config.get('buckets'):
+        raise ValueError('from/to require buckets in config.json')
+    end = _parse_time(event['to']) if event.get('to') else time.time()
+    return _parse_time(event['from']), end
+
+
+def _window_buckets(window, resolution):
+    """ returns the (days, hours) buckets covering the window. With hourly
+        buckets, complete days in the past are returned as daily buckets,
+        which are rolled up from their hours
+    """
+    start, end = window
+    now = time.time()
+    step = BUCKET_SECONDS[resolution]
+    days = []
+    hours = []
+    timestamp = start - start % step
+    while timestamp <= end:
+        day_start = timestamp - timestamp % BUCKET_SECONDS['day']
+        day_end = day_start + BUCKET_SECONDS['day']
+        complete_day = start <= timestamp == day_start and day_end <= min(end + 1, now)
+        if resolution == 'day' or complete_day:
+            days.append(_bucket(timestamp, 'day'))
+            timestamp = day_end
+        else:
+            hours.append(_bucket(timestamp, 'hour'))
+            timestamp += step
+    return days, hours
+
+
+def _window_counts(r, keys, window):
+    """ returns the counts of the union of the buckets of each key within the
+        window. Missing daily rollups of hourly buckets are created with
+        PFMERGE, for the days that have hourly buckets. They expire `ttl`
+        after their day ends, like its last hourly bucket
+    """
+    bucket_config = config['buckets']
+    resolution = bucket_config.get('resolution', 'day')
+    days, hours = _window_buckets(window, resolution)
+    if not days and not hours:
+        return [0] * len(keys)
+    if resolution == 'hour' and days:
+        # calendar is slow to import and only needed for time windows
+        import calendar
+        lifetime = BUCKET_SECONDS['day'] + bucket_config.get('ttl', BUCKET_TTL)
+        expire_at = dict((day, lifetime + calendar.timegm(
+            time.strptime(day, BUCKET_FORMATS['day']))) for day in days)
+        rollups = [(_bucket_key(key, day), day) for key in keys for day in days]
+
+        def hourly(rollup_key):
+            return ['{0}{1:02d}'.format(rollup_key, hour) for hour in range(24)]
+
+        def exists(pipe, rollup):
+            pipe.exists(rollup[0])
+            pipe.execute_command('EXISTS', *hourly(rollup[0]))
+        found = _pipelined(r, exists, rollups)
+
+        def roll_up(pipe, rollup):
+            rollup_key, day = rollup
+            pipe.pfmerge(rollup_key, *hourly(rollup_key))
+            pipe.expireat(rollup_key, expire_at[day])
+        _pipelined(r, roll_up, [rollup for rollup, rolled_up, hourly_buckets
+                                in zip(rollups, found[0::2], found[1::2])
+                                if not rolled_up and hourly_buckets])
+    return _pipelined(
+        r,
+        lambda pipe, key: pipe.pfcount(
+            *[_bucket_key(key, bucket) for bucket in days + hours]),
+        keys)
+
+
+def _pipelined(r, command, items, raise_on_error=True):
+    """ calls `command(pipe, item)` for each item and returns the results,
+        sending at most BULK_CHUNK_SIZE commands per pipeline. errors are
+        returned in place of the results unless `raise_on_error`
+    """
+    items = list(items)
+    results = []
+    for i in range(0, len(items), BULK_CHUNK_SIZE):
+        pipe = r.pipeline(transaction=False)
+        for item in items[i:i + BULK_CHUNK_SIZE]:
+            command(pipe, item)
+        metrics.size('redis.pipeline_size', len(pipe.command_stack))
+        with metrics.timer('redis.pipeline'):
+            results.extend(pipe.execute(raise_on_error=raise_on_error))
+    return results
+
+
+def _counts(r, keys):
+    """ returns the count of every counter key, whether it's an exact set or
+        a HyperLogLog, with pipelined PFCOUNT commands rather than a script,
+        so redis isn't blocked while a whole chunk is counted. replicas
+        can't run scripts anyway: they don't have the scripts loaded on the
+        master, and refuse scripts calling PFCOUNT on newer redis versions.
+        PFCOUNT caches the cardinality in the HyperLogLog, which replicas
+        only do in their own copy (it isn't replicated, and is reset by the
+        next PFADD from the master). exact sets fail PFCOUNT and are counted
+        again with SCARD
+    """
+    counts = _pipelined(r, lambda pipe, key: pipe.pfcount(key), keys, raise_on_error=False)
+    sets = _wrong_type(counts)
+    for i, count in zip(sets, _pipelined(r, lambda pipe, i: pipe.scard(keys[i]), sets)):
+        counts[i] = count
+    return counts
+
+
+def _wrong_type(results):
+    """ returns the indexes of the pipeline results that failed with
+        WRONGTYPE (i.e. exact sets instead of HyperLogLogs), and raises any
+        other error
+    """
+    indexes = []
+    for i, result in enumerate(results):
+        if isinstance(result, redis.ResponseError):
+            if not str(result).startswith('WRONGTYPE'):
+                raise result
+            indexes.append(i)
+    return indexes
+
+
+def _get_all(r, keys):
+    """ returns {key: value} with a (chunked) pipeline of GETs """
+    return dict(zip(keys, _pipelined(r, lambda pipe, key: pipe.get(key), keys)))
+
+
+def _local_counts(r, keys):
+    """ returns the count of every counter key, estimated in-process from
+        the raw HyperLogLogs (see `local_counts` in config.json). only the
+        headers are fetched first, since they hold the count cached by the
+        last PFCOUNT, and then the HyperLogLogs that changed since. exact
+        sets are counted with SCARD
+    """
+    headers = _pipelined(
+        r, lambda pipe, key: pipe.getrange(key, 0, hll.HEADER_SIZE - 1), keys,
+        raise_on_error=False)
+    sets = _wrong_type(headers)
+    exact = set(sets)
+    counts = [None if i in exact else hll.cached_cardinality(header)
+              for i, header in enumerate(headers)]
+    for i, count in zip(sets, _pipelined(r, lambda pipe, i: pipe.scard(keys[i]), sets)):
+        counts[i] = count
+    changed = [keys[i] for i, count in enumerate(counts) if count is None]
+    sketches = _get_all(r, changed)
+    return [hll.cardinality(sketches[key]) if count is None else count
+            for key, count in zip(keys, counts)]
+
+
+def _local_window_counts(r, keys, window):
+    """ like _window_counts(), but the buckets are fetched and merged
+        in-process. no rollups are created: days without a rollup are the
+        union of their hourly buckets instead
+    """
+    resolution = config['buckets'].get('resolution', 'day')
+    days, hours = _window_buckets(window, resolution)
+    buckets = dict((key, [_bucket_key(key, bucket) for bucket in days + hours])
+                   for key in keys)
+    sketches = _get_all(r, [bucket for key in keys for bucket in buckets[key]])
+    if resolution == 'hour' and days:
+        def hourly(rollup):
+            return ['{0}{1:02d}'.format(rollup, hour) for hour in range(24)]
+        missing = [rollup for key in keys for rollup in buckets[key][:len(days)]
+                   if sketches[rollup] is None]
+        sketches.update(_get_all(r, [bucket for rollup in missing for bucket in hourly(rollup)]))
+        for key in keys:
+            day_buckets = []
+            for rollup in buckets[key][:len(days)]:
+                day_buckets.extend([rollup] if sketches[rollup] is not None else hourly(rollup))
+            buckets[key] = day_buckets + buckets[key][len(days):]
+    counts = []
+    for key in keys:
+        found = [sketches[bucket] for bucket in buckets[key] if sketches[bucket]]
+        if len(found) < 2:
+            counts.append(hll.cardinality(found[0] if found else None))
+        else:
+            counts.append(hll.count(hll.union([hll.registers(sketch) for sketch in found])))
+    return counts
+
+
+def _results_dicts(r, namespace, experiments, window=None):
+    """ returns {experiment: results dict} for all `experiments`, with one
+        (chunked) pipeline for all the counter keys, and another for all the
+        counts (within the time window, if given). counts are read from the
+        replicas when configured, except within a time window, which may
+        create daily rollups on the master (unless counted in-process)
+    """
+    local_counts = config.get('local_counts', False)
+    reader = r if window and not local_counts else _reader(r)
+    key_sets = _pipelined(
+        reader,
+        lambda pipe, ex: pipe.smembers(
+            '{0}:{1}:counter_keys'.format(namespace, ex)),
+        experiments)
+    keys = [key for key_set in key_sets for key in key_set]
+    if local_counts and window:
+        values = _local_window_counts(_raw_reader(r), keys, window)
+    elif local_counts:
+        values = _local_counts(_raw_reader(r), keys)
+    elif window:
+        values = _window_counts(r, keys, window)
+    else:
+        values = _counts(reader, keys)
+    counts = dict(zip(keys, values))
+    return dict((ex, dict((key, counts[key]) for key in key_set))
+                for ex, key_set in zip(experiments, key_sets))
+
+
 def _results_dict(namespace, experiment):
     """ returns a dict in the following format:
         {namespace.counters.experiment.goal.variant: count}
     """
-    r = _redis()
-    keys = r.smembers("{0}:{1}:counter_keys".format(namespace, experiment))
-    pipe = r.pipeline()
-    for key in keys:
-        pipe.pfcount(key)
-    values = pipe.execute()
-    return dict(zip(keys, values))
+    return _results_dicts(_redis(namespace, experiment), namespace,
+                          [experiment])[experiment]
 
 
-def _experiment_goals(namespace, experiment):
-    raw_results = _results_dict(namespace, experiment)
+def _experiment_goals(namespace, experiment, raw_results=None):
+    """ returns the results of each goal. counts of sampled experiments are
+        scaled up by the sample rate, and include `sample_rate`
+    """
+    if raw_results is None:
+        raw_results = _results_dict(namespace, experiment)
+    sample_rate = _sampling(experiment).get('rate', 1)
     variants = set([x.split(':')[-1] for x in raw_results.keys()])
     goals = set([x.split(':')[-2] for x in raw_results.keys()])
     goals.discard('participate')
@@ -49,46 +695,237 @@ def _experiment_goals(namespace, experiment):
                 _counter_key(namespace, experiment, 'participate', variant), 0)
             successes = raw_results.get(
                 _counter_key(namespace, experiment, goal, variant), 0)
-            goal_data['results'].append(
-                {'label': variant,
-                'successes': successes,
-                'trials': trials})
+            result = {'label': variant,
+                      'successes': successes,
+                      'trials': trials}
+            if sample_rate < 1:
+                result.update(successes=int(round(successes / sample_rate)),
+                              trials=int(round(trials / sample_rate)),
+                              sample_rate=sample_rate)
+            goal_data['results'].append(result)
         goal_results.append(goal_data)
     return goal_results
 
 
+def _results_cache_key(namespace, experiment):
+    return '{0}:{1}:results_cache'.format(namespace, experiment)
+
+
+def _cached_goals(namespace, experiments, fresh=False, window=None):
+    """ returns {experiment: goals} for all `experiments`, querying all the
+        redis shards in parallel
+    """
+    experiment_goals = {}
+    for goals in _fan_out(_shard_cached_goals,
+                          [(r, namespace, shard_experiments, fresh, window)
+                           for r, shard_experiments in _by_shard(namespace, experiments).items()]):
+        experiment_goals.update(goals)
+    return experiment_goals
+
+
+def _shard_cached_goals(r, namespace, experiments, fresh=False, window=None):
+    """ returns {experiment: goals} for `experiments` stored on `r`.
+
+        When `results_cache` is configured in config.json, results are
+        cached in redis for `ttl` seconds. Once expired, cached results are
+        still served for another `stale_ttl` seconds while a single caller
+        recalculates them. `fresh` bypasses the cache. Results within a time
+        window are never cached
+    """
+    cache_config = config.get('results_cache', {})
+    ttl = cache_config.get('ttl', 0) if window is None else 0
+    stale_ttl = cache_config.get('stale_ttl', 0)
+    experiment_goals = {}
+    if ttl and not fresh:
+        stale = []
+        cached_results = _pipelined(
+            r,
+            lambda pipe, ex: pipe.get(_results_cache_key(namespace, ex)),
+            experiments)
+        for ex, cached in zip(experiments, cached_results):
+            if cached:
+                cached = json.loads(cached)
+                experiment_goals[ex] = cached['goals']
+                if time.time() - cached['at'] >= ttl:
+                    stale.append(ex)
+        # stale results are only recalculated by whoever gets the lock
+        locks = _pipelined(
+            r,
+            lambda pipe, ex: pipe.set(
+                '{0}:lock'.format(_results_cache_key(namespace, ex)), 1,
+                ex=RESULTS_CACHE_LOCK_TIMEOUT, nx=True),
+            stale)
+        for ex, locked in zip(stale, locks):
+            if locked:
+                del experiment_goals[ex]
+
+    missing = [ex for ex in experiments if ex not in experiment_goals]
+    raw_results = _results_dicts(r, namespace, missing, window)
+    for ex in missing:
+        experiment_goals[ex] = _experiment_goals(namespace, ex, raw_results[ex])
+
+    if ttl and missing:
+        def cache(pipe, ex):
+            key = _results_cache_key(namespace, ex)
+            pipe.set(key, json.dumps({'at': time.time(),
+                                      'goals': experiment_goals[ex]}),
+                     ex=ttl + stale_ttl)
+            pipe.delete('{0}:lock'.format(key))
+        _pipelined(r, cache, missing)
+    return experiment_goals
+
+
+def _truthy(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def _experiments_page(namespace, cursor='0', limit=100):
+    """ returns (experiments, next cursor) using SSCAN on the experiments set
+        of each node in turn. a cursor is `{node}:{sscan cursor}` (or just the
+        sscan cursor on the first node), and '0' once all nodes are scanned.
+        SSCAN may return a few more experiments than `limit`
+    """
+    clients = _redis_clients()
+    experiments_set_key = '{0}:experiments'.format(namespace)
+    node, _, scan_cursor = str(cursor).rpartition(':')
+    node = int(node or 0)
+    scan_cursor = int(scan_cursor)
+    experiments = []
+    while len(experiments) < limit:
+        scan_cursor, page = clients[node].sscan(experiments_set_key, scan_cursor,
+                                                count=limit - len(experiments))
+        experiments.extend(page)
+        if scan_cursor == 0:
+            node += 1
+            if node == len(clients):
+                return experiments, '0'
+    if node == 0:
+        return experiments, str(scan_cursor)
+    return experiments, '{0}:{1}'.format(node, scan_cursor)
+
+
+@metrics.timed
 def experiment(event, context):
     """ retrieves a single experiment results from redis
         params:
             - experiment - name of the experiment
             - namespace (optional)
+            - fresh (optional, bypasses the results cache)
+            - from, to (optional, UTC time window. requires buckets)
+            - stats (optional, adds conversion rates and significance)
+            - control (optional, the control variant for stats)
     """
     experiment = event['experiment']
     namespace = event.get('namespace', 'alephbet')
-    return _experiment_goals(namespace, experiment)
+    goals = _cached_goals(namespace, [experiment],
+                          _truthy(event.get('fresh')),
+                          _window(event))[experiment]
+    if _truthy(event.get('stats')):
+        stats.add_stats([goals], event.get('control'))
+    return goals
 
 
+@metrics.timed
 def all(event, context):
     """ retrieves all experiment results from redis
         params:
             - namespace (optional)
             - scope (optional, comma-separated list of experiments)
+            - limit, cursor (optional, returns about `limit` experiments
+              and the cursor of the next page in `meta`. '0' is the first
+              and the last page)
+            - fresh (optional, bypasses the results cache)
+            - from, to (optional, UTC time window. requires buckets)
+            - stats (optional, adds conversion rates and significance)
+            - control (optional, the control variant for stats)
     """
-    r = _redis()
     namespace = event.get('namespace', 'alephbet')
     scope = event.get('scope')
+    meta = {'scope': scope}
     if scope:
         experiments = scope.split(',')
+    elif event.get('limit'):
+        experiments, meta['cursor'] = _experiments_page(
+            namespace, event.get('cursor') or '0', int(event['limit']))
     else:
-        experiments = r.smembers("{0}:experiments".format(namespace))
+        experiments_set_key = '{0}:experiments'.format(namespace)
+        experiments = set().union(*_fan_out(
+            lambda r: r.smembers(experiments_set_key),
+            [(r,) for r in _redis_clients()]))
+    experiments = list(experiments)
+    experiment_goals = _cached_goals(namespace, experiments,
+                                     _truthy(event.get('fresh')),
+                                     _window(event))
+    if _truthy(event.get('stats')):
+        stats.add_stats([experiment_goals[ex] for ex in experiments],
+                        event.get('control'))
     results = []
-    results.append({'meta': {'scope': scope}})
+    results.append({'meta': meta})
     for ex in experiments:
-        goals = experiment({'experiment': ex, 'namespace': namespace}, context)
-        results.append({'experiment': ex, 'goals': goals})
+        results.append({'experiment': ex, 'goals': experiment_goals[ex]})
     return results
 
 
+def _track_events(events, namespace='alephbet', timestamp=None):
+    """ tracks `events` with one TRACK_SCRIPT call per counter key, passing
+        all uuids of the same counter key together. calls for different
+        redis shards run in parallel. `timestamp` picks the time bucket
+    """
+    counters = {}
+    for event in events:
+        event_namespace = event.get('namespace') or namespace
+        experiment = event['experiment']
+        key = _counter_key(event_namespace, experiment, event['event'],
+                           event['variant'])
+        counters.setdefault(
+            (event_namespace, experiment, key), []).append(event['uuid'])
+    _track_counters(counters, timestamp)
+
+
+def _track_counters(counters, timestamp=None):
+    """ tracks {(namespace, experiment, counter key): [uuids]} with a
+        TRACK_SCRIPT call per counter key (and per SCRIPT_MAX_UUIDS uuids)
+    """
+    bucket_config = config.get('buckets')
+    rollup = None
+    if bucket_config:
+        resolution = bucket_config.get('resolution', 'day')
+        bucket = _bucket(timestamp or time.time(), resolution)
+        bucket_ttl = bucket_config.get('ttl', BUCKET_TTL)
+        # daily rollups of hourly buckets (see _window_counts) are created
+        # once a day is over, so tracking into a past day (a backfill, or a
+        # lagging drain) deletes its rollup, to be rolled up again
+        if resolution == 'hour' and bucket[:8] < _bucket(time.time(), 'day'):
+            rollup = bucket[:8]
+    counter_keys_index = config.get('counter_keys_index', False)
+    exact_threshold = config.get('exact_threshold', 0)
+    calls = {}
+    rollups = {}
+    for (event_namespace, experiment, key), uuids in counters.items():
+        keys = (key,
+                '{0}:experiments'.format(event_namespace),
+                '{0}:{1}:counter_keys'.format(event_namespace, experiment))
+        args = [experiment, 0, exact_threshold]
+        if bucket_config:
+            keys += (_bucket_key(key, bucket),)
+            args = [experiment, bucket_ttl, exact_threshold]
+        if counter_keys_index:
+            keys += ('{0}:counter_keys'.format(event_namespace),)
+        metrics.count('events', len(uuids), experiment=experiment)
+        r = _redis(event_namespace, experiment)
+        shard_calls = calls.setdefault(r, [])
+        for i in range(0, len(uuids), SCRIPT_MAX_UUIDS):
+            shard_calls.append((keys, args + uuids[i:i + SCRIPT_MAX_UUIDS]))
+        if rollup:
+            rollups.setdefault(r, []).append(_bucket_key(key, rollup))
+    _fan_out(_execute_script, [(r, TRACK_SCRIPT, shard_calls)
+                               for r, shard_calls in calls.items()])
+    if rollups:
+        _fan_out(_pipelined, [(r, lambda pipe, key: pipe.delete(key), keys)
+                              for r, keys in rollups.items()])
+
+
+@metrics.timed
 def track(event, context):
     """ tracks an alephbet event (participate, goal etc)
         params:
@@ -98,50 +935,409 @@ def track(event, context):
             - event - either the goal name or 'participate'
             - namespace (optional)
     """
-    experiment = event['experiment']
-    namespace = event.get('namespace', 'alephbet')
-    uuid = event['uuid']
-    variant = event['variant']
-    tracking_event = event['event']
+    _track_or_queue([event])
 
-    r = _redis()
+
+@metrics.timed
+def track_batch(event, context):
+    """ tracks a batch of alephbet events in a single round trip
+        params:
+            - events - a list of events, each with the same params as `track`
+            - namespace (optional, default for events without a namespace)
+    """
+    events = event.get('events')
+    if not events:
+        return
+    if not isinstance(events, list) or any(not isinstance(item, dict) for item in events):
+        raise ValueError('events must be a list of events')
+    _track_or_queue(events, event.get('namespace') or 'alephbet')
+
+
+def _ingest_queue():
+    """ returns the queue for `ingest` in config.json, or None. the queue is
+        on its own `ingest.redis` node, or else on the first redis node
+    """
+    global _queue
+    ingest_config = config.get('ingest')
+    if not ingest_config:
+        return None
+    if _queue is None:
+        with _client_lock:
+            if _queue is None:
+                if ingest_config.get('redis'):
+                    r, _ = _node_clients(ingest_config['redis'])
+                else:
+                    r = _redis_clients()[0]
+                _queue = ingest.queue(ingest_config, r)
+    return _queue
+
+
+class _TokenBucket(object):
+    """ allows `rate` events per second on average, and bursts of up to
+        `burst` events
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def _sampling(experiment):
+    """ returns the `sampling` settings of the experiment (or of `*`) """
+    sampling = config.get('sampling') or {}
+    return sampling.get(experiment) or sampling.get('*') or {}
+
+
+def _rate_limiter(namespace, experiment, settings):
+    """ rate limiters are kept in memory, across warm lambda invocations """
+    key = (namespace, experiment)
+    if key not in _rate_limiters:
+        with _client_lock:
+            if key not in _rate_limiters:
+                _rate_limiters[key] = _TokenBucket(settings['max_per_second'],
+                                                   settings.get('burst'))
+    return _rate_limiters[key]
+
+
+def _in_sample(experiment, uuid, rate):
+    """ whether the uuid is in the sample of the experiment. the sample is
+        picked by hashing the uuid, so a uuid is either always or never
+        tracked in an experiment
+    """
+    return rate >= 1 or _hash('{0}:{1}'.format(experiment, uuid)) < rate * 0x100000000
+
+
+def _sample(events, namespace='alephbet'):
+    """ drops the events of sampled experiments whose uuid falls outside the
+        sample, and events over the experiment's rate limit
+    """
+    sampled = []
+    for event in events:
+        experiment = event['experiment']
+        settings = _sampling(experiment)
+        if not settings:
+            sampled.append(event)
+            continue
+        if not _in_sample(experiment, event['uuid'], settings.get('rate', 1)):
+            continue
+        if settings.get('max_per_second'):
+            limiter = _rate_limiter(event.get('namespace') or namespace, experiment, settings)
+            if not limiter.take():
+                metrics.count('rate_limited', experiment=experiment)
+                continue
+        sampled.append(event)
+    return sampled
+
+
+def _recently_tracked():
+    """ returns the cache of recently tracked (counter key, uuid) pairs for
+        `dedupe` in config.json, or None. the cache is kept in memory, across
+        warm lambda invocations
+    """
+    global _recent
+    dedupe_config = config.get('dedupe')
+    if not dedupe_config:
+        return None
+    if _recent is None:
+        with _client_lock:
+            if _recent is None:
+                _recent = dedupe.RecentlySeen(dedupe_config.get('capacity', DEDUPE_CAPACITY),
+                                              dedupe_config.get('ttl', DEDUPE_TTL))
+    return _recent
+
+
+def _drop_seen(recent, events, namespace='alephbet'):
+    """ drops the events that were tracked recently by this container.
+        returns the other events and their keys, which are added to the
+        cache once the events are tracked. with time buckets, the key
+        includes the current bucket, so a uuid is tracked again in the next bucket
+    """
+    bucket_config = config.get('buckets')
+    bucket = bucket_config and _bucket(time.time(), bucket_config.get('resolution', 'day'))
+    unseen = []
+    keys = []
+    for event in events:
+        key = (_counter_key(event.get('namespace') or namespace, event['experiment'],
+                            event['event'], event['variant']), event['uuid'], bucket)
+        if not recent.seen(key):
+            unseen.append(event)
+            keys.append(key)
+    if len(unseen) < len(events):
+        metrics.count('dedupe_hits', len(events) - len(unseen))
+    if unseen:
+        metrics.count('dedupe_misses', len(unseen))
+    return unseen, keys
+
+
+def _track_or_queue(events, namespace='alephbet'):
+    """ queues the events when `ingest` is configured. when the queue is
+        full (the drain is lagging behind), events are tracked directly.
+        sampling, rate limits and the `dedupe` cache are applied before either
+    """
+    if config.get('sampling'):
+        events = _sample(events, namespace)
+        if not events:
+            return
+    recent = _recently_tracked()
+    if recent is not None:
+        events, keys = _drop_seen(recent, events, namespace)
+        if not events:
+            return
+    queue = _ingest_queue()
+    queued = False
+    if queue is not None:
+        events = [_queued_event(event) for event in events]
+        queued = queue.append(namespace, events, time.time())
+    if not queued:
+        _track_events(events, namespace)
+    # only events that were tracked (or queued) are remembered
+    if recent is not None:
+        recent.add(keys)
+
+
+def _queued_event(event):
+    """ the fields of an event that are queued. missing fields raise a
+        KeyError, like tracking directly, so they never reach the queue
+    """
+    queued = dict((field, event[field]) for field in EVENT_FIELDS)
+    if event.get('namespace'):
+        queued['namespace'] = event['namespace']
+    return queued
+
+
+def _valid_event(event):
+    # all() is the handler in this module
+    return isinstance(event, dict) and set(EVENT_FIELDS).issubset(event)
+
+
+@metrics.timed
+def drain(event, context):
+    """ tracks queued events in batches of `batch_size`, until the queue is
+        empty or `max_seconds` have passed. invalid events and entries that
+        can't be parsed are acknowledged and dropped, so they don't block the
+        queue. records the queue lag as the ingest.queued and
+        ingest.lag_seconds metrics, and returns it with the number of drained
+        and invalid events
+        params:
+            - batch_size (optional)
+            - max_seconds (optional)
+    """
+    queue = _ingest_queue()
+    if queue is None:
+        raise ValueError('ingest is not configured')
+    default_batch_size = config['ingest'].get('batch_size', INGEST_BATCH_SIZE)
+    batch_size = int(event.get('batch_size') or default_batch_size)
+    deadline = time.time() + float(event.get('max_seconds') or 50)
+    bucket_config = config.get('buckets')
+    drained = invalid = 0
+    while time.time() < deadline:
+        entries = queue.read(batch_size)
+        if not entries:
+            break
+        # events are tracked in the time bucket of when they were queued
+        by_bucket = {}
+        for entry_id, namespace, timestamp, events in entries:
+            if not isinstance(events, list):
+                invalid += 1
+                continue
+            valid = [event for event in events if _valid_event(event)]
+            invalid += len(events) - len(valid)
+            bucket = bucket_config and _bucket(timestamp, bucket_config.get('resolution', 'day'))
+            by_bucket.setdefault(bucket, (timestamp, []))[1].extend(
+                dict(event, namespace=event.get('namespace') or namespace)
+                for event in valid)
+        for timestamp, events in by_bucket.values():
+            _track_events(events, timestamp=timestamp)
+            drained += len(events)
+        queue.ack([entry[0] for entry in entries])
+    if invalid:
+        metrics.count('ingest_invalid', invalid)
+    lag = queue.lag()
+    metrics.size('ingest.queued', lag['queued'])
+    metrics.size('ingest.lag_seconds', lag['lag_seconds'])
+    return dict(lag, drained=drained, invalid=invalid)
+
+
+def _chunks(iterable, size=DELETE_CHUNK_SIZE):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _unlink_command(r):
+    """ UNLINK (redis >= 4) frees the memory of deleted keys in a background
+        thread. DEL frees it while blocking redis
+    """
+    global _unlink
+    if _unlink is None:
+        try:
+            r.execute_command('UNLINK')
+        except redis.ResponseError as error:
+            _unlink = 'DEL' if 'unknown command' in str(error).lower() else 'UNLINK'
+    return _unlink
+
+
+def _bucket_keys(counter_keys):
+    """ yields the time buckets (and daily rollups) the counter keys can have:
+        every bucket within the bucket ttl, whether it exists or not.
+        buckets dated earlier (by a backfill) expire with their ttl instead
+    """
+    bucket_config = config['buckets']
+    resolution = bucket_config.get('resolution', 'day')
+    step = BUCKET_SECONDS[resolution]
+    now = time.time()
+    # a bucket expires `ttl` seconds after its first event
+    start = now - bucket_config.get('ttl', BUCKET_TTL) - step
+    buckets = []
+    timestamp = now - now % step
+    while timestamp >= start:
+        buckets.append(_bucket(timestamp, resolution))
+        if resolution == 'hour' and timestamp % BUCKET_SECONDS['day'] == 0:
+            buckets.append(_bucket(timestamp, 'day'))
+        timestamp -= step
+    for counter_key in counter_keys:
+        prefix = _bucket_key(counter_key, '')
+        for bucket in buckets:
+            yield prefix + bucket
+
+
+def _reclaim(r, namespace, experiment, tombstone, progress=None):
+    """ deletes the counter keys listed in `tombstone` and their time
+        buckets, DELETE_CHUNK_SIZE keys at a time, so redis is never blocked
+        for long. keys are removed from the tombstone as they are deleted, so
+        an interrupted reclaim can be resumed. counter keys tracked again
+        since the experiment was deleted are kept.
+        `progress(deleted)` is called after each chunk
+    """
+    unlink = _unlink_command(r)
+    counters_set_key = '{0}:{1}:counter_keys'.format(namespace, experiment)
+    all_counters_set_key = '{0}:counter_keys'.format(namespace)
+    deleted = 0
+    for keys in _chunks(r.sscan_iter(tombstone, count=DELETE_CHUNK_SIZE)):
+        # buckets go first, since their counter keys are what names them
+        if config.get('buckets'):
+            pipe = r.pipeline(transaction=False)
+            for key in keys:
+                pipe.sismember(counters_set_key, key)
+            stale = [key for key, tracked in zip(keys, pipe.execute()) if not tracked]
+            # deleting missing keys costs nothing, so they aren't looked up
+            for bucket_keys in _chunks(_bucket_keys(stale)):
+                deleted += r.execute_command(unlink, *bucket_keys)
+        deleted += _execute_script(r, RECLAIM_SCRIPT, [
+            ([counters_set_key, all_counters_set_key, tombstone] + keys, [unlink])])[0]
+        if progress:
+            progress(deleted)
+    r.execute_command(unlink, tombstone)
+    return deleted
+
+
+def _tombstone(r, namespace, experiment):
+    """ removes the experiment from the experiments set and moves its counter
+        set to a tombstone key in a single transaction, so it's gone for
+        readers immediately. returns the tombstone key
+    """
+    counters_set_key = '{0}:{1}:counter_keys'.format(namespace, experiment)
+    tombstone = '{0}:deleted:{1}:{2}'.format(namespace, experiment, int(time.time() * 1000))
     pipe = r.pipeline()
-    key = '{0}:counters:{1}:{2}:{3}'.format(
-        namespace, experiment, tracking_event, variant)
-    pipe.sadd('{0}:experiments'.format(namespace), experiment)
-    pipe.sadd('{0}:counter_keys'.format(namespace), key)
-    pipe.sadd('{0}:{1}:counter_keys'.format(namespace, experiment), key)
-    pipe.pfadd(key, uuid)
+    pipe.srem('{0}:experiments'.format(namespace), experiment)
+    pipe.delete(_results_cache_key(namespace, experiment))
+    if r.exists(counters_set_key):
+        pipe.rename(counters_set_key, tombstone)
+    pipe.hset('{0}:deleted'.format(namespace), tombstone,
+              json.dumps({'experiment': experiment, 'deleted': 0}))
     pipe.execute()
+    return tombstone
+
+
+def reclaim_deletes(namespace, progress=None):
+    """ reclaims the keys of all tombstoned experiments in the namespace.
+        `progress(experiment, deleted)` is called after each chunk
+    """
+    tombstones_key = '{0}:deleted'.format(namespace)
+    deleted = 0
+    for r in _redis_clients():
+        for tombstone, state in r.hgetall(tombstones_key).items():
+            experiment = json.loads(state)['experiment']
+
+            def chunk_done(count):
+                r.hset(tombstones_key, tombstone,
+                       json.dumps({'experiment': experiment, 'deleted': count}))
+                if progress:
+                    progress(experiment, count)
 
+            deleted += _reclaim(r, namespace, experiment, tombstone, chunk_done)
+            r.hdel(tombstones_key, tombstone)
+    return deleted
 
+
+def pending_deletes(namespace='alephbet'):
+    """ returns {tombstone key: {experiment, deleted}} for the experiments
+        that are still being reclaimed
+    """
+    return dict((tombstone, json.loads(state)) for r in _redis_clients()
+                for tombstone, state in r.hgetall('{0}:deleted'.format(namespace)).items())
+
+
+@metrics.timed
+def reclaim(event, context):
+    """ deletes the remaining keys of experiments deleted with `async`
+        params:
+            - namespace (optional)
+    """
+    return {'deleted': reclaim_deletes(event.get('namespace', 'alephbet'))}
+
+
+@metrics.timed
 def delete(event, context):
     """ delete an experiment
         params:
             - experiment - name of the experiment
             - namespace
+            - async (optional, removes the experiment immediately and deletes
+              its keys in a background thread)
     """
 
-    r = _redis()
     namespace = event.get('namespace', 'alephbet')
     experiment = event['experiment']
+    r = _redis(namespace, experiment)
     experiments_set_key = '{0}:experiments'.format(namespace)
-    experiment_counters_set_key = '{0}:{1}:counter_keys'.format(namespace, experiment)
-    all_counters_set_key = '{0}:counter_keys'.format(namespace)
 
-    if r.sismember(experiments_set_key, experiment):
-        counter_keys = r.smembers(
-            experiment_counters_set_key
-        )
-        pipe = r.pipeline()
-        for key in counter_keys:
-            pipe.srem(all_counters_set_key, key)
-            pipe.delete(key)
-        pipe.delete(
-            experiment_counters_set_key
-        )
-        pipe.srem(
-            experiments_set_key,
-            experiment
-        )
-        pipe.execute()
+    if not r.sismember(experiments_set_key, experiment):
+        return {'experiment': experiment, 'deleted': 0}
+    # only this container forgets the uuids it tracked. other containers
+    # skip theirs for up to the dedupe ttl (see README)
+    if _recent is not None:
+        _recent.clear()
+    # the experiment is removed and its counter set renamed atomically
+    # first. events tracked while the keys are deleted list the experiment
+    # again, and start its counters over (see TRACK_SCRIPT)
+    tombstone = _tombstone(r, namespace, experiment)
+    if _truthy(event.get('async')):
+        thread = threading.Thread(target=reclaim_deletes, args=(namespace,))
+        thread.daemon = True
+        thread.start()
+        return {'experiment': experiment, 'pending': tombstone}
+    deleted = _reclaim(r, namespace, experiment, tombstone)
+    r.hdel('{0}:deleted'.format(namespace), tombstone)
+    return {'experiment': experiment, 'deleted': deleted}
+
+
+metrics.timing('cold_start', (time.time() - _import_started) * 1000)
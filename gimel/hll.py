@@ -0,0 +1,231 @@
+from __future__ import division
+import math
+import struct
+try:
+    from gimel import optional
+except ImportError:
+    import optional
+
+# the layout of redis HyperLogLogs (see hyperloglog.c in redis): a 16 bytes
+# header ('HYLL', the encoding, 3 unused bytes and the cached cardinality)
+# followed by either the dense or the sparse registers
+MAGIC = b'HYLL'
+DENSE = 0
+SPARSE = 1
+P = 14
+REGISTERS = 1 << P
+Q = 64 - P
+HEADER_SIZE = 16
+DENSE_SIZE = REGISTERS * 6 // 8
+ALPHA_INF = 0.5 / math.log(2)
+# sparse HyperLogLogs shorter than this are faster to decode without numpy
+NUMPY_MIN_SPARSE_SIZE = 512
+
+
+def _python_dense(body):
+    # every 3 bytes hold 4 registers of 6 bits, least significant bits first
+    b0, b1, b2 = body[0::3], body[1::3], body[2::3]
+    registers = bytearray(REGISTERS)
+    registers[0::4] = bytearray(b & 0x3f for b in b0)
+    registers[1::4] = bytearray(x >> 6 | (y & 0x0f) << 2 for x, y in zip(b0, b1))
+    registers[2::4] = bytearray(x >> 4 | (y & 0x03) << 4 for x, y in zip(b1, b2))
+    registers[3::4] = bytearray(b >> 2 for b in b2)
+    return registers
+
+
+def _numpy_dense(numpy, body):
+    groups = numpy.frombuffer(body, dtype=numpy.uint8).reshape(-1, 3)
+    b0, b1, b2 = groups[:, 0], groups[:, 1], groups[:, 2]
+    registers = numpy.empty((REGISTERS // 4, 4), dtype=numpy.uint8)
+    registers[:, 0] = b0 & 0x3f
+    registers[:, 1] = b0 >> 6 | (b1 & 0x0f) << 2
+    registers[:, 2] = b1 >> 4 | (b2 & 0x03) << 4
+    registers[:, 3] = b2 >> 2
+    return registers.ravel()
+
+
+def _python_runs(body):
+    """ decodes the sparse opcodes into (values, lengths) of register runs:
+        ZERO (00xxxxxx) and XZERO (01xxxxxx yyyyyyyy) are runs of empty
+        registers, VAL (1vvvvvxx) is a run of xx + 1 registers set to vvvvv + 1
+    """
+    values = []
+    lengths = []
+    i = 0
+    while i < len(body):
+        opcode = body[i]
+        if opcode < 0x40:
+            values.append(0)
+            lengths.append((opcode & 0x3f) + 1)
+        elif opcode < 0x80:
+            i += 1
+            values.append(0)
+            lengths.append(((opcode & 0x3f) << 8 | body[i]) + 1)
+        else:
+            values.append((opcode >> 2 & 0x1f) + 1)
+            lengths.append((opcode & 0x03) + 1)
+        i += 1
+    return values, lengths
+
+
+def _numpy_runs(numpy, body):
+    """ like _python_runs(), without a loop: the only two bytes opcode is
+        XZERO, so a byte starts an opcode unless the byte before it starts
+        an XZERO, i.e. is at an even offset within a run of XZERO-like bytes
+    """
+    data = numpy.frombuffer(body, dtype=numpy.uint8)
+    if not len(data):
+        return data, data
+    index = numpy.arange(len(data))
+    xzero = (data & 0xc0) == 0x40
+    run_starts = xzero & ~numpy.concatenate(([False], xzero[:-1]))
+    offset = index - numpy.maximum.accumulate(numpy.where(run_starts, index, 0))
+    xzero_starts = xzero & (offset % 2 == 0)
+    second = numpy.concatenate(([False], xzero_starts[:-1]))
+    opcodes = data[~second].astype(numpy.int64)
+    following = numpy.concatenate((data[1:], [0])).astype(numpy.int64)[~second]
+    val = opcodes >= 0x80
+    values = numpy.where(val, (opcodes >> 2 & 0x1f) + 1, 0)
+    lengths = numpy.where(val, (opcodes & 0x03) + 1, (opcodes & 0x3f) + 1)
+    lengths = numpy.where(xzero[~second], ((opcodes & 0x3f) << 8 | following) + 1, lengths)
+    return values, lengths
+
+
+def _sparse_runs(body):
+    numpy = optional.import_numpy()
+    if numpy and len(body) >= NUMPY_MIN_SPARSE_SIZE:
+        values, lengths = _numpy_runs(numpy, body)
+        total = int(lengths.sum())
+    else:
+        values, lengths = _python_runs(body)
+        total = sum(lengths)
+    if total != REGISTERS:
+        raise ValueError('corrupt sparse HyperLogLog')
+    return values, lengths
+
+
+def _parse(data):
+    """ returns the encoding and body of a HyperLogLog """
+    data = bytearray(data)
+    if data[:4] != MAGIC:
+        raise ValueError('not a redis HyperLogLog')
+    if data[4] not in (DENSE, SPARSE):
+        raise ValueError('unknown HyperLogLog encoding {0}'.format(data[4]))
+    body = data[HEADER_SIZE:]
+    if data[4] == DENSE and len(body) != DENSE_SIZE:
+        raise ValueError('corrupt dense HyperLogLog')
+    return data[4], body
+
+
+def registers(data):
+    """ returns the registers of a redis HyperLogLog from its raw bytes (as
+        returned by GET), as a numpy array when numpy is available and a
+        bytearray otherwise. missing keys (None) have empty registers
+    """
+    numpy = optional.import_numpy()
+    if not data:
+        return numpy.zeros(REGISTERS, dtype=numpy.uint8) if numpy else bytearray(REGISTERS)
+    encoding, body = _parse(data)
+    if encoding == DENSE:
+        return _numpy_dense(numpy, body) if numpy else _python_dense(body)
+    values, lengths = _sparse_runs(body)
+    if numpy:
+        return numpy.repeat(numpy.asarray(values, dtype=numpy.uint8), lengths)
+    registers = bytearray()
+    for value, length in zip(values, lengths):
+        registers.extend(bytearray((value,)) * length)
+    return registers
+
+
+def union(registers_list):
+    """ returns the registers of the union of HyperLogLogs, like PFMERGE """
+    merged = registers_list[0]
+    for other in registers_list[1:]:
+        if isinstance(merged, bytearray) and isinstance(other, bytearray):
+            merged = bytearray(map(max, merged, other))
+        else:
+            merged = optional.import_numpy().maximum(merged, other)
+    return merged
+
+
+def _sigma(x):
+    if x == 1:
+        return float('inf')
+    y = 1.0
+    z = x
+    while True:
+        x *= x
+        previous = z
+        z += x * y
+        y += y
+        if z == previous:
+            return z
+
+
+def _tau(x):
+    if x == 0 or x == 1:
+        return 0.0
+    y = 1.0
+    z = 1 - x
+    while True:
+        x = math.sqrt(x)
+        previous = z
+        y *= 0.5
+        z -= (1 - x) ** 2 * y
+        if z == previous:
+            return z / 3
+
+
+def count(registers):
+    """ returns the estimated cardinality of the registers """
+    if isinstance(registers, bytearray):
+        histogram = [registers.count(bytearray((value,))) for value in range(Q + 2)]
+    else:
+        histogram = optional.import_numpy().bincount(registers, minlength=Q + 2).tolist()
+    return _estimate(histogram)
+
+
+def _estimate(histogram):
+    """ the estimator of redis 5 and above (Ertl's improved raw estimator),
+        from the number of registers with each value
+    """
+    m = REGISTERS
+    z = m * _tau((m - histogram[Q + 1]) / m)
+    for value in range(Q, 0, -1):
+        z += histogram[value]
+        z *= 0.5
+    z += m * _sigma(histogram[0] / m)
+    return int(ALPHA_INF * m * m / z + 0.5)
+
+
+def cached_cardinality(data):
+    """ returns the cardinality cached in the header of a HyperLogLog (the
+        first HEADER_SIZE bytes are enough), or None when it isn't valid,
+        i.e. the HyperLogLog changed since the last PFCOUNT
+    """
+    header = bytearray(data[:HEADER_SIZE]) if data else bytearray()
+    if len(header) < HEADER_SIZE or header[:4] != MAGIC or header[15] & 0x80:
+        return None
+    return struct.unpack('<Q', bytes(header[8:]))[0]
+
+
+def cardinality(data):
+    """ returns the count of a HyperLogLog from its raw bytes, like PFCOUNT """
+    cached = cached_cardinality(data)
+    if cached is not None:
+        return cached
+    if not data:
+        return 0
+    encoding, body = _parse(data)
+    if encoding == DENSE:
+        return count(registers(data))
+    # sparse HyperLogLogs are counted from their runs of registers
+    values, lengths = _sparse_runs(body)
+    if isinstance(values, list):
+        histogram = [0] * (Q + 2)
+        for value, length in zip(values, lengths):
+            histogram[value] += length
+    else:
+        numpy = optional.import_numpy()
+        histogram = numpy.bincount(values, weights=lengths, minlength=Q + 2).tolist()
+    return _estimate(histogram)
@@ -0,0 +1,114 @@
+from __future__ import division
+import hashlib
+import importlib
+import json
+import time
+import redis
+
+CONSUMER_GROUP = 'gimel'
+CONSUMER = 'gimel'
+
+# KEYS: stream
+# ARGV: max length, namespace, timestamp, events (json)
+# the entry is only added while the stream is shorter than max length
+APPEND_SCRIPT = """
+if redis.call('XLEN', KEYS[1]) >= tonumber(ARGV[1]) then
+    return false
+end
+return redis.call('XADD', KEYS[1], '*', 'namespace', ARGV[2], 'at', ARGV[3],
+                  'events', ARGV[4])
+"""
+
+
+class RedisStreamQueue(object):
+    """ queues tracked events on a redis stream, one entry per track call.
+        entries are read through a consumer group and deleted once they're
+        acknowledged, so the stream length is the backlog. entries that were
+        read but never acknowledged (e.g. the consumer crashed) are read
+        again, so every event is counted at least once
+    """
+
+    def __init__(self, r, stream='gimel:ingest', max_length=1000000, **options):
+        self.r = r
+        self.stream = stream
+        self.max_length = max_length
+        self.append_script = r.register_script(APPEND_SCRIPT)
+        self.append_script.sha = hashlib.sha1(APPEND_SCRIPT.encode('utf-8')).hexdigest()
+        self.group_created = False
+
+    def append(self, namespace, events, timestamp):
+        """ returns False when the stream is full """
+        return self.append_script(
+            keys=[self.stream],
+            args=[self.max_length, namespace, timestamp, json.dumps(events)]) is not None
+
+    def _create_group(self):
+        try:
+            self.r.execute_command('XGROUP', 'CREATE', self.stream, CONSUMER_GROUP,
+                                   '0', 'MKSTREAM')
+        except redis.ResponseError as error:
+            if 'BUSYGROUP' not in str(error):
+                raise
+        self.group_created = True
+
+    def _read(self, count, start):
+        response = self.r.execute_command(
+            'XREADGROUP', 'GROUP', CONSUMER_GROUP, CONSUMER, 'COUNT', count,
+            'STREAMS', self.stream, start)
+        return response[0][1] if response else []
+
+    def read(self, count):
+        """ returns up to `count` [(entry id, namespace, timestamp, events)],
+            starting with entries that were read before but not acknowledged.
+            events is None for entries that can't be parsed
+        """
+        if not self.group_created:
+            self._create_group()
+        entries = self._read(count, '0') or self._read(count, '>')
+        results = []
+        for entry_id, fields in entries:
+            # entries deleted while pending have no fields
+            fields = dict(zip(fields[::2], fields[1::2])) if fields else {}
+            try:
+                timestamp = float(fields.get('at', 0))
+                events = json.loads(fields.get('events', '[]'))
+            except ValueError:
+                timestamp, events = time.time(), None
+            results.append((entry_id, fields.get('namespace'), timestamp, events))
+        return results
+
+    def ack(self, entry_ids):
+        pipe = self.r.pipeline(transaction=False)
+        pipe.execute_command('XACK', self.stream, CONSUMER_GROUP, *entry_ids)
+        pipe.execute_command('XDEL', self.stream, *entry_ids)
+        pipe.execute()
+
+    def lag(self):
+        """ returns the number of queued entries and the age of the oldest """
+        pipe = self.r.pipeline(transaction=False)
+        pipe.execute_command('XLEN', self.stream)
+        pipe.execute_command('XRANGE', self.stream, '-', '+', 'COUNT', 1)
+        queued, oldest = pipe.execute()
+        lag_seconds = 0
+        if oldest:
+            lag_seconds = max(time.time() - int(oldest[0][0].split('-')[0]) / 1000, 0)
+        return {'queued': queued, 'lag_seconds': lag_seconds}
+
+
+BACKENDS = {'redis_stream': RedisStreamQueue}
+
+
+def queue(ingest_config, r):
+    """ returns the queue for the `ingest` section of config.json. `backend`
+        is either one of BACKENDS, or `module:Class` for a custom queue with
+        the same methods, created with (redis client, **ingest_config)
+    """
+    options = dict(ingest_config)
+    backend = options.pop('backend', 'redis_stream')
+    options.pop('redis', None)
+    if backend in BACKENDS:
+        queue_class = BACKENDS[backend]
+    else:
+        module, _, name = backend.partition(':')
+        queue_class = getattr(importlib.import_module(module), name)
+    return queue_class(r, **options)
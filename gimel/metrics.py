@@ -0,0 +1,180 @@
+from __future__ import print_function
+import functools
+import importlib
+import json
+import socket
+import sys
+import threading
+import time
+
+
+class MemorySink(object):
+    """ keeps every value in memory, e.g. for benchmarks """
+
+    def __init__(self, **options):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def record(self, kind, name, value, dimensions):
+        key = (name, tuple(sorted(dimensions.items())))
+        with self.lock:
+            self.values.setdefault(key, []).append(value)
+
+    def flush(self):
+        pass
+
+
+class EMFSink(object):
+    """ prints the metrics of each handler call as a single JSON log line in
+        the CloudWatch embedded metric format, one line per set of dimensions
+    """
+    UNITS = {'timing': 'Milliseconds', 'count': 'Count', 'size': 'Count'}
+
+    def __init__(self, namespace='gimel', stream=None, **options):
+        self.namespace = namespace
+        self.stream = stream or sys.stdout
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def record(self, kind, name, value, dimensions):
+        key = tuple(sorted(dimensions.items()))
+        with self.lock:
+            metrics = self.values.setdefault(key, {})
+            metrics.setdefault(name, (self.UNITS[kind], []))[1].append(value)
+
+    def flush(self):
+        with self.lock:
+            values, self.values = self.values, {}
+        timestamp = int(time.time() * 1000)
+        for dimensions, metrics in values.items():
+            document = dict(dimensions)
+            document['_aws'] = {
+                'Timestamp': timestamp,
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [[name for name, _ in dimensions]],
+                    'Metrics': [{'Name': name, 'Unit': unit}
+                                for name, (unit, _) in sorted(metrics.items())]}]}
+            for name, (unit, metric_values) in metrics.items():
+                document[name] = metric_values if len(metric_values) > 1 else metric_values[0]
+            print(json.dumps(document, sort_keys=True), file=self.stream)
+
+
+class StatsDSink(object):
+    """ sends every value over UDP to statsd, with the dimensions as
+        (dogstatsd) tags
+    """
+    TYPES = {'timing': 'ms', 'count': 'c', 'size': 'h'}
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='gimel.', **options):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, kind, name, value, dimensions):
+        line = '{0}{1}:{2}|{3}'.format(self.prefix, name, value, self.TYPES[kind])
+        if dimensions:
+            line += '|#' + ','.join('{0}:{1}'.format(*item) for item in sorted(dimensions.items()))
+        try:
+            self.socket.sendto(line.encode('utf-8'), self.address)
+        except socket.error:
+            pass
+
+    def flush(self):
+        pass
+
+
+SINKS = {'memory': MemorySink, 'emf': EMFSink, 'statsd': StatsDSink}
+
+_sink = None
+
+
+def configure(metrics_config):
+    """ sets the sink from the `metrics` section of config.json. `sink` is
+        either one of SINKS, `null` (the default, no metrics) or
+        `module:Class` for a custom sink with the same methods
+    """
+    global _sink
+    options = dict(metrics_config or {})
+    name = options.pop('sink', 'null')
+    if name == 'null':
+        sink = None
+    elif name in SINKS:
+        sink = SINKS[name](**options)
+    else:
+        module, _, class_name = name.partition(':')
+        sink = getattr(importlib.import_module(module), class_name)(**options)
+    _sink = sink
+    return sink
+
+
+def enabled():
+    return _sink is not None
+
+
+def timing(name, milliseconds, **dimensions):
+    if _sink is not None:
+        _sink.record('timing', name, milliseconds, dimensions)
+
+
+def count(name, value=1, **dimensions):
+    if _sink is not None:
+        _sink.record('count', name, value, dimensions)
+
+
+def size(name, value, **dimensions):
+    if _sink is not None:
+        _sink.record('size', name, value, dimensions)
+
+
+class _Timer(object):
+    def __init__(self, name, dimensions):
+        self.name = name
+        self.dimensions = dimensions
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        timing(self.name, (time.time() - self.start) * 1000, **self.dimensions)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def timer(name, **dimensions):
+    """ times a `with` block. a no-op when metrics are off """
+    if _sink is None:
+        return _null_timer
+    return _Timer(name, dimensions)
+
+
+def timed(handler):
+    """ records the duration and errors of a lambda handler, and flushes
+        the sink after each call
+    """
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if _sink is None:
+            return handler(event, context)
+        start = time.time()
+        try:
+            return handler(event, context)
+        except Exception:
+            count('errors', handler=name)
+            raise
+        finally:
+            timing('duration', (time.time() - start) * 1000, handler=name)
+            _sink.flush()
+    return wrapper
@@ -0,0 +1,18 @@
+""" optional dependencies, which aren't part of the lambda package """
+
+_numpy = None
+
+
+def import_numpy():
+    """ returns numpy, or False when it isn't installed. it's only imported
+        when first needed (stats or in-process counts), keeping cold starts
+        fast
+    """
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy
@@ -0,0 +1,163 @@
+from __future__ import print_function
+import json
+import os
+import signal
+import sys
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qsl
+try:
+    from gimel import logger
+    from gimel import gimel
+    from gimel.config import config
+    from gimel.deploy import WIRING
+except ImportError:
+    import logger
+    import gimel
+    from config import config
+    from deploy import WIRING
+
+logger = logger.setup()
+RESPONSE_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*',
+    'Pragma': 'no-cache',
+    'Cache-Control': 'no-cache, no-store, must-revalidate'
+}
+
+
+def _routes():
+    """ maps each API gateway path in the wiring to its http method, handler
+        and whether it requires an api key
+    """
+    routes = {}
+    for component in WIRING + config.get('extra_wiring', []):
+        api = component['api_gateway']
+        handler = component['lambda']['Handler'].split('.')[-1]
+        routes['/{}'.format(api['pathPart'])] = (
+            api['method']['httpMethod'],
+            getattr(gimel, handler),
+            api['method'].get('apiKeyRequired', False))
+    return routes
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """ runs the gimel handlers with the same event the API gateway request
+        template produces: a dict of the query string parameters. A JSON
+        array in the request body is passed as `events`
+    """
+    protocol_version = 'HTTP/1.1'
+    routes = {}
+    # limits concurrent handler calls, see _max_requests()
+    slots = None
+
+    def _respond(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for header, value in dict(RESPONSE_HEADERS, **(headers or {})).items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _event(self, url, payload):
+        event = dict(parse_qsl(url.query))
+        if payload:
+            body = json.loads(payload.decode('utf-8'))
+            if isinstance(body, list):
+                event['events'] = body
+            else:
+                event.update(body)
+        return event
+
+    def _handle(self):
+        url = urlparse(self.path)
+        # the body is always read, even for error responses, otherwise it
+        # would be parsed as the next request on the kept-alive connection
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = self.rfile.read(length) if length else b''
+        if url.path not in self.routes:
+            return self._respond(404, {'message': 'Not Found'})
+        http_method, handler, api_key_required = self.routes[url.path]
+        if self.command == 'OPTIONS':
+            return self._respond(200, None, {
+                'Access-Control-Allow-Methods': '{},OPTIONS'.format(http_method),
+                'Access-Control-Allow-Headers': 'Content-Type,X-Api-Key'})
+        if self.command != http_method:
+            return self._respond(405, {'message': 'Method Not Allowed'})
+        api_key = config.get('server', {}).get('api_key')
+        if api_key_required and api_key and self.headers.get('X-Api-Key') != api_key:
+            return self._respond(403, {'message': 'Forbidden'})
+        try:
+            event = self._event(url, payload)
+            if self.slots is None:
+                return self._respond(200, handler(event, None))
+            with self.slots:
+                result = handler(event, None)
+            return self._respond(200, result)
+        except (KeyError, ValueError) as error:
+            return self._respond(400, {'errorMessage': repr(error)})
+        except Exception as error:
+            logger.exception('{} {} failed'.format(self.command, self.path))
+            return self._respond(500, {'errorMessage': repr(error)})
+
+    do_GET = do_POST = do_DELETE = do_OPTIONS = _handle
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _max_requests():
+    """ returns the number of handler calls each worker runs at a time:
+        `server.max_requests`, or else the smallest `max_connections` of the
+        redis nodes, since the redis connection pools fail instead of
+        waiting for a free connection. None is unlimited
+    """
+    max_requests = config.get('server', {}).get('max_requests')
+    if max_requests:
+        return max_requests
+    nodes = config.get('redis_shards') or [config.get('redis') or {}]
+    limits = [node['max_connections'] for node in nodes if node.get('max_connections')]
+    return min(limits) if limits else None
+
+
+def serve(host='127.0.0.1', port=8000, workers=1):
+    """ serves the gimel handlers over http. connections are kept alive, and
+        each worker process shares one redis connection pool between its
+        request threads
+    """
+    RequestHandler.routes = _routes()
+    max_requests = _max_requests()
+    RequestHandler.slots = max_requests and threading.BoundedSemaphore(max_requests)
+    if not config.get('server', {}).get('api_key'):
+        logger.warning('no server.api_key in config.json. '
+                       'experiments and delete are not protected')
+    server = Server((host, port), RequestHandler)
+    children = []
+    for _ in range(workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            children = []
+            break
+        children.append(pid)
+    if children:
+        # make sure workers are stopped together with the parent process
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        server.server_close()
@@ -0,0 +1,147 @@
+from __future__ import division
+import math
+try:
+    from gimel import optional
+except ImportError:
+    import optional
+
+# z for a two-sided 95% interval
+Z_95 = 1.959963984540054
+STATS = ('rate', 'ci_low', 'ci_high', 'z', 'p_value', 'probability_to_beat_control')
+
+
+def _python_cell(successes, trials, control_successes, control_trials):
+    rate = successes / trials if trials else 0.0
+    p = min(rate, 1.0)
+    if trials:
+        # wilson score interval
+        denominator = 1 + Z_95 ** 2 / trials
+        center = (p + Z_95 ** 2 / (2 * trials)) / denominator
+        spread = p * (1 - p) / trials + Z_95 ** 2 / (4 * trials ** 2)
+        margin = Z_95 * math.sqrt(spread) / denominator
+        ci = (center - margin, center + margin)
+    else:
+        ci = (0.0, 0.0)
+    z = p_value = None
+    if trials and control_trials:
+        # pooled two-proportion z-test (the same p-value as a 2x2 chi-square)
+        pooled = min((successes + control_successes) / (trials + control_trials), 1.0)
+        se = math.sqrt(pooled * (1 - pooled) * (1 / trials + 1 / control_trials))
+        if se:
+            z = (rate - control_successes / control_trials) / se
+            p_value = math.erfc(abs(z) / math.sqrt(2))
+    # P(variant > control) with Beta(1 + successes, 1 + failures) posteriors,
+    # using the normal approximation of their difference
+    mean, variance = _beta(successes, trials)
+    control_mean, control_variance = _beta(control_successes, control_trials)
+    beat = 0.5 * math.erfc(-(mean - control_mean) / math.sqrt(2 * (variance + control_variance)))
+    return (rate, ci[0], ci[1], z, p_value, beat)
+
+
+def _beta(successes, trials):
+    a = 1 + min(successes, trials)
+    b = 1 + trials - min(successes, trials)
+    return a / (a + b), a * b / ((a + b) ** 2 * (a + b + 1))
+
+
+def _erfc(numpy, x):
+    """ vectorized erfc (abramowitz & stegun 7.1.26, error < 1.5e-7) """
+    t = 1 / (1 + 0.3275911 * numpy.abs(x))
+    y = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (
+        -1.453152027 + t * 1.061405429)))) * numpy.exp(-x * x)
+    return numpy.where(x >= 0, y, 2 - y)
+
+
+def _numpy_cells(numpy, successes, trials, control_successes, control_trials):
+    s = numpy.asarray(successes, dtype=float)
+    t = numpy.asarray(trials, dtype=float)
+    cs = numpy.asarray(control_successes, dtype=float)
+    ct = numpy.asarray(control_trials, dtype=float)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        rate = numpy.where(t > 0, s / t, 0.0)
+        p = numpy.minimum(rate, 1.0)
+        denominator = 1 + Z_95 ** 2 / t
+        center = (p + Z_95 ** 2 / (2 * t)) / denominator
+        margin = Z_95 * numpy.sqrt(p * (1 - p) / t + Z_95 ** 2 / (4 * t ** 2)) / denominator
+        ci_low = numpy.where(t > 0, center - margin, 0.0)
+        ci_high = numpy.where(t > 0, center + margin, 0.0)
+        pooled = numpy.minimum((s + cs) / (t + ct), 1.0)
+        se = numpy.sqrt(pooled * (1 - pooled) * (1 / t + 1 / ct))
+        z = (rate - cs / ct) / se
+        tested = (t > 0) & (ct > 0) & (se > 0)
+        z = numpy.where(tested, z, numpy.nan)
+        p_value = numpy.where(tested, _erfc(numpy, numpy.abs(z) / math.sqrt(2)), numpy.nan)
+        a = 1 + numpy.minimum(s, t)
+        b = 1 + t - numpy.minimum(s, t)
+        ca = 1 + numpy.minimum(cs, ct)
+        cb = 1 + ct - numpy.minimum(cs, ct)
+        difference = a / (a + b) - ca / (ca + cb)
+        variance = a * b / ((a + b) ** 2 * (a + b + 1))
+        variance += ca * cb / ((ca + cb) ** 2 * (ca + cb + 1))
+        beat = 0.5 * _erfc(numpy, -difference / numpy.sqrt(2 * variance))
+    columns = []
+    for column in (rate, ci_low, ci_high, z, p_value, beat):
+        missing = numpy.isnan(column)
+        column = column.astype(object)
+        column[missing] = None
+        columns.append(column.tolist())
+    return list(zip(*columns))
+
+
+def cells(successes, trials, control_successes, control_trials):
+    """ returns a STATS tuple for every (successes, trials) cell compared to
+        its control cell. all cells are computed in one pass with numpy when
+        it's available, and one by one otherwise. numpy has no erfc, so
+        p_value and probability_to_beat_control differ from the pure python
+        ones by up to 1.5e-7 (see _erfc)
+    """
+    numpy = optional.import_numpy()
+    if numpy:
+        return _numpy_cells(numpy, successes, trials, control_successes, control_trials)
+    return [_python_cell(*cell) for cell
+            in zip(successes, trials, control_successes, control_trials)]
+
+
+def control_variant(goals, control=None):
+    """ the control variant is the `control` label, a variant called
+        'control', or else the first variant in alphabetical order
+    """
+    labels = set(result['label'] for goal in goals for result in goal['results'])
+    if control in labels:
+        return control
+    if 'control' in labels:
+        return 'control'
+    return min(labels) if labels else None
+
+
+def _sampled(result, count):
+    return int(round(result.get(count, 0) * result.get('sample_rate', 1)))
+
+
+def add_stats(experiments_goals, control=None):
+    """ adds STATS to every variant result of every goal, for a list of
+        experiment goals (as returned by the experiments endpoint). the
+        control variant itself (and goals without a control variant) get no
+        z, p_value or probability_to_beat_control
+    """
+    results = []
+    control_results = []
+    for goals in experiments_goals:
+        control_label = control_variant(goals, control)
+        for goal in goals:
+            control_result = dict((result['label'], result)
+                                  for result in goal['results']).get(control_label)
+            for result in goal['results']:
+                results.append(result)
+                control_results.append(control_result or {})
+    # sampled counts are scaled up, the tests use the counts of the sample
+    computed = cells([_sampled(result, 'successes') for result in results],
+                     [_sampled(result, 'trials') for result in results],
+                     [_sampled(result, 'successes') for result in control_results],
+                     [_sampled(result, 'trials') for result in control_results])
+    for result, control_result, values in zip(results, control_results, computed):
+        result.update(zip(STATS, values))
+        if result is control_result or not control_result:
+            for stat in ('z', 'p_value', 'probability_to_beat_control'):
+                result[stat] = None
+    return experiments_goals
@@ -0,0 +1,143 @@
+""" checks that deploy leaves API methods and lambda functions alone when they
+already match. AWS is replaced with the botocore Stubber, which fails on any
+call that isn't expected (e.g. a method put again although it matches), so
+no credentials are needed
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from botocore.stub import Stubber
+
+from gimel import aws_api, deploy
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+ROLE_ARN = 'arn:aws:iam::123456789012:role/gimel'
+FUNCTION_ARN = 'arn:aws:lambda:us-east-1:123456789012:function:gimel-track'
+FUNCTION_URI = 'arn:aws:apigateway:us-east-1:lambda:path/2015-03-31/functions/{}/invocations'
+ALIAS_ARN = FUNCTION_ARN + ':' + deploy.LIVE
+VERSIONS = {'Versions': [{'Version': version} for version in ('$LATEST', '1', '2')]}
+
+
+def _calls(stubber, func, *args):
+    """ returns (result, AWS calls) of `func(*args)` with the stubbed responses """
+    stubbed = len(stubber._queue)
+    with stubber:
+        result = func(*args)
+        stubber.assert_no_pending_responses()
+    return result, stubbed
+
+
+def _desired_method(wiring):
+    """ the (method, integration, method_response, integration_response) that
+        api_method() puts for the wiring
+    """
+    desired = {}
+    put_method = deploy._put_method
+    deploy._put_method = lambda api_id, resource_id, **parts: desired.update(parts)
+    try:
+        deploy.api_method('api', 'resource', ROLE_ARN, FUNCTION_URI.format(FUNCTION_ARN),
+                          wiring['api_gateway'])
+    finally:
+        deploy._put_method = put_method
+    return desired
+
+
+def _get_method(method, integration, method_response, integration_response):
+    """ the get_method response of a deployed method """
+    deployed_integration = dict((k, v) for k, v in integration.items()
+                                if k != 'integrationHttpMethod')
+    return dict(method,
+                methodResponses={'200': dict(method_response, statusCode='200')},
+                methodIntegration=dict(
+                    deployed_integration, httpMethod=integration['integrationHttpMethod'],
+                    integrationResponses={'200': dict(integration_response, statusCode='200')}))
+
+
+class TestPutMethod(unittest.TestCase):
+
+    def _put_method(self, changed):
+        desired = _desired_method(deploy.WIRING[0])
+        deployed = dict(desired)
+        if changed:
+            deployed['integration'] = dict(desired['integration'], uri=FUNCTION_URI.format('old'))
+        stubber = Stubber(aws_api.client('apigateway'))
+        stubber.add_response('get_method', _get_method(**deployed))
+        if changed:
+            for action in ('delete_method', 'put_method', 'put_integration',
+                           'put_method_response', 'put_integration_response'):
+                stubber.add_response(action, {})
+        updated, calls = _calls(stubber, deploy._put_method, 'api', 'resource',
+                                desired['method'], desired['integration'],
+                                desired['method_response'], desired['integration_response'])
+        self.assertEqual(updated, changed)
+        return calls
+
+    def test_unchanged_method_is_left_alone(self):
+        self.assertEqual(self._put_method(False), 1)
+
+    def test_changed_method_is_put_again(self):
+        self.assertEqual(self._put_method(True), 6)
+
+
+class TestCreateUpdateLambda(unittest.TestCase):
+
+    def setUp(self):
+        self.wiring = deploy.WIRING[0]['lambda']
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        with open('gimel.zip', 'wb') as zf:
+            zf.write(json.dumps(self.wiring).encode('utf-8'))
+        self.code_sha256 = deploy._zip_sha256()[1]
+        self.stubber = Stubber(aws_api.client('lambda'))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def _get_function(self, code_sha256):
+        wiring = self.wiring
+        configuration = dict(FunctionName=wiring['FunctionName'], Runtime=deploy.RUNTIME,
+                             Role=ROLE_ARN, Handler=wiring['Handler'],
+                             MemorySize=wiring['MemorySize'], Timeout=wiring['Timeout'],
+                             CodeSha256=code_sha256)
+        self.stubber.add_response('get_function', {'Configuration': configuration})
+
+    def _update_alias(self, version):
+        self.stubber.add_response('update_alias', {'AliasArn': ALIAS_ARN},
+                                  {'FunctionName': self.wiring['FunctionName'],
+                                   'FunctionVersion': version, 'Name': deploy.LIVE})
+
+    def _create_update_lambda(self):
+        arn, calls = _calls(self.stubber, deploy.create_update_lambda, ROLE_ARN, self.wiring)
+        self.assertEqual(arn, ALIAS_ARN)
+        return calls
+
+    def test_unchanged_function_is_left_alone(self):
+        self._get_function(self.code_sha256)
+        self.stubber.add_response('get_alias', {'AliasArn': ALIAS_ARN, 'FunctionVersion': '2'})
+        self.stubber.add_response('list_versions_by_function', VERSIONS)
+        self.assertEqual(self._create_update_lambda(), 3)
+
+    def test_rolled_back_alias_moves_to_the_latest_version(self):
+        self._get_function(self.code_sha256)
+        self.stubber.add_response('get_alias', {'AliasArn': ALIAS_ARN, 'FunctionVersion': '1'})
+        self.stubber.add_response('list_versions_by_function', VERSIONS)
+        self._update_alias('2')
+        self.assertEqual(self._create_update_lambda(), 4)
+
+    def test_changed_code_is_uploaded(self):
+        self._get_function('changed')
+        self.stubber.add_response('update_function_code',
+                                  {'FunctionArn': FUNCTION_ARN, 'Version': '2'},
+                                  {'FunctionName': self.wiring['FunctionName'], 'Publish': True,
+                                   'ZipFile': json.dumps(self.wiring).encode('utf-8')})
+        self._update_alias('2')
+        self.stubber.add_response('list_versions_by_function', VERSIONS)
+        self.assertEqual(self._create_update_lambda(), 4)
@@ -0,0 +1,90 @@
+""" checks that counting raw HyperLogLogs in-process matches PFCOUNT, with
+numpy and in pure python. needs redis-server on the PATH, and is skipped
+without it
+"""
+import socket
+import subprocess
+import time
+import unittest
+
+from gimel import gimel  # noqa, puts the vendored redis first on sys.path
+from gimel import hll, optional
+import redis
+
+# sparse up to a few thousand uuids, dense beyond
+SIZES = (0, 1, 10, 100, 1000, 3000, 10000, 50000, 200000)
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TestHyperLogLog(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        port = _free_port()
+        try:
+            cls.process = subprocess.Popen(
+                ['redis-server', '--port', str(port), '--save', '', '--appendonly', 'no'],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except OSError:
+            raise unittest.SkipTest('redis-server is not on the PATH')
+        cls.r = redis.Redis(port=port)
+        for _ in range(100):
+            try:
+                cls.r.ping()
+                break
+            except redis.ConnectionError:
+                time.sleep(0.05)
+        cls.sketches = {}
+        for size in SIZES:
+            key = 'hll:{0}'.format(size)
+            uuids = ['{0}-uuid-{1}'.format(size, i) for i in range(size)]
+            cls.r.pfadd(key, *uuids[:1])
+            for i in range(1, size, 10000):
+                cls.r.pfadd(key, *uuids[i:i + 10000])
+            # fetched before PFCOUNT, which would cache the cardinality
+            cls.sketches[size] = cls.r.get(key)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.process.terminate()
+        cls.process.wait()
+
+    def tearDown(self):
+        optional._numpy = None
+
+    def _paths(self):
+        """ yields the name of each path, with numpy (when installed) and in
+            pure python
+        """
+        if optional.import_numpy():
+            yield 'numpy'
+        optional._numpy = False
+        yield 'python'
+
+    def test_cardinality_matches_pfcount(self):
+        for path in self._paths():
+            for size in SIZES:
+                self.assertEqual(hll.cardinality(self.sketches[size]),
+                                 self.r.pfcount('hll:{0}'.format(size)),
+                                 '{0} uuids with {1}'.format(size, path))
+
+    def test_union_matches_pfcount(self):
+        pairs = [(1000, 3000), (3000, 200000), (10000, 50000), (0, 100)]
+        for path in self._paths():
+            for sizes in pairs:
+                union = hll.union([hll.registers(self.sketches[size]) for size in sizes])
+                expected = self.r.pfcount(*['hll:{0}'.format(size) for size in sizes])
+                self.assertEqual(hll.count(union), expected,
+                                 'union of {0} with {1}'.format(sizes, path))
+
+    def test_cached_cardinality(self):
+        key = 'hll:{0}'.format(SIZES[-1])
+        count = self.r.pfcount(key)
+        self.assertEqual(hll.cached_cardinality(self.r.get(key)), count)
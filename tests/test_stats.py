@@ -0,0 +1,95 @@
+""" checks that the numpy and pure python stats agree, and how add_stats
+picks the control variant
+"""
+import random
+import unittest
+
+from gimel import optional, stats
+
+# the numpy path approximates erfc (abramowitz & stegun 7.1.26), with an
+# absolute error below 1.5e-7. small p-values can differ by more in relative
+# terms, so erfc-based stats are compared with an absolute tolerance
+ERFC_TOLERANCE = 1.5e-7
+ERFC_STATS = ('p_value', 'probability_to_beat_control')
+
+
+def _cells(count):
+    rng = random.Random(0)
+    trials = [rng.randint(0, 5000) for _ in range(count)]
+    successes = [rng.randint(0, t) for t in trials]
+    # edge cases: no trials, no successes, all successes and an empty control
+    trials += [0, 100, 100, 100]
+    successes += [0, 0, 100, 50]
+    control_trials = list(reversed(trials[:count])) + [100, 100, 100, 0]
+    control_successes = list(reversed(successes[:count])) + [10, 0, 100, 0]
+    return successes, trials, control_successes, control_trials
+
+
+def _goals(*results):
+    return [{'goal': 'participate', 'results': [
+        {'label': label, 'successes': successes, 'trials': trials}
+        for label, successes, trials in results]}]
+
+
+class TestCells(unittest.TestCase):
+
+    def tearDown(self):
+        optional._numpy = None
+
+    def test_numpy_and_python_agree(self):
+        if not optional.import_numpy():
+            raise unittest.SkipTest('numpy is not installed')
+        cells = _cells(2000)
+        computed = stats.cells(*cells)
+        optional._numpy = False
+        expected = stats.cells(*cells)
+        self.assertEqual(len(computed), len(expected))
+        for cell, values, expected_values in zip(zip(*cells), computed, expected):
+            for stat, value, expected_value in zip(stats.STATS, values, expected_values):
+                message = '{0} of {1}'.format(stat, cell)
+                if expected_value is None:
+                    self.assertIsNone(value, message)
+                elif stat in ERFC_STATS:
+                    self.assertAlmostEqual(value, expected_value, delta=ERFC_TOLERANCE,
+                                           msg=message)
+                else:
+                    self.assertAlmostEqual(value, expected_value,
+                                           delta=1e-9 * max(abs(expected_value), 1), msg=message)
+
+    def test_python_cell(self):
+        optional._numpy = False
+        rate, ci_low, ci_high, z, p_value, beat = stats.cells([60], [1000], [40], [1000])[0]
+        self.assertEqual(rate, 0.06)
+        self.assertTrue(ci_low < rate < ci_high)
+        self.assertAlmostEqual(z, 2.0520, places=4)
+        self.assertAlmostEqual(p_value, 0.0402, places=4)
+        self.assertTrue(0.97 < beat < 0.99)
+
+
+class TestAddStats(unittest.TestCase):
+
+    def test_control_gets_no_comparison(self):
+        goals = _goals(('control', 40, 1000), ('b', 60, 1000))
+        stats.add_stats([goals])
+        control, variant = goals[0]['results']
+        self.assertIsNone(control['p_value'])
+        self.assertIsNone(control['probability_to_beat_control'])
+        self.assertEqual(control['rate'], 0.04)
+        self.assertAlmostEqual(variant['p_value'], 0.0402, places=4)
+
+    def test_control_label(self):
+        goals = _goals(('a', 40, 1000), ('b', 60, 1000))
+        self.assertEqual(stats.control_variant(goals), 'a')
+        self.assertEqual(stats.control_variant(goals, 'b'), 'b')
+        stats.add_stats([goals], control='b')
+        self.assertIsNone(goals[0]['results'][1]['z'])
+        self.assertAlmostEqual(goals[0]['results'][0]['z'], -2.0520, places=4)
+
+    def test_sampled_counts(self):
+        goals = _goals(('control', 40, 1000), ('b', 60, 1000))
+        for result in goals[0]['results']:
+            result['sample_rate'] = 0.1
+        sampled = _goals(('control', 4, 100), ('b', 6, 100))
+        stats.add_stats([goals])
+        stats.add_stats([sampled])
+        self.assertEqual(goals[0]['results'][1]['p_value'], sampled[0]['results'][1]['p_value'])